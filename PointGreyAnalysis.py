@@ -0,0 +1,221 @@
+'''
+Absorption imaging analysis of repeated shot sequences as the frames are
+retrieved, without saving and reloading the images.
+
+An AbsorptionStage attached to a PointGreyController (see attachStage)
+treats the frames of a run as repetitions of a sequence of roles, by default
+atoms, probe and dark: frame i has role roles[i % len(roles)]. Each complete
+sequence yields an optical density image
+
+	OD = -ln((atoms - dark) / (probe - dark))
+
+and the running mean and variance of the optical density and of every role
+are updated with Welford's algorithm. The statistics build up over all runs
+of the controller, for example one run per repetition, until reset() is
+called or the image size changes. All arrays are allocated when the first
+run starts, so memory use does not grow with the number of repetitions.
+
+Dropped frames are detected from the embedded timestamps of the frames
+(PointGreyController.frameWords), which needs the time between the frames
+of a sequence: period_ms, or else the trigger period of the run (see
+PointGreyController.runPeriod). After a drop the incomplete sequence is
+discarded and the roles of the following frames are shifted by the number
+of frames missed, so they are not analysed in the wrong role.
+
+The retrieval thread only copies each frame into a sequence buffer; the
+arithmetic runs on a worker thread of the stage, overlapping with the
+retrieval of the next sequence.
+
+	stage = AbsorptionStage()
+	PGC.attachStage(stage)
+	for repetition in range(repetitions):
+		PGC.startStreaming(3, keepImages = False)
+		...
+		PGC.stop()
+	stage.stats['od'].mean, stage.stats['od'].variance()
+'''
+
+from PointGreyController import decodeTimestamps
+from threading import Thread
+from Queue import Queue
+import numpy
+
+class RunningStats(object):
+	"""Running mean and variance of equally shaped images (Welford's algorithm)."""
+
+	def __init__(self, shape):
+		self.count = 0
+		self.mean = numpy.zeros(shape)
+		self.m2 = numpy.zeros(shape)	# Sum of squared deviations from the mean.
+		self.delta = numpy.empty(shape)
+		self.step = numpy.empty(shape)
+
+	def reset(self):
+		self.count = 0
+		self.mean.fill(0)
+		self.m2.fill(0)
+
+	def add(self, x):
+		'''Adds one image.'''
+		self.count += 1
+		delta = self.delta
+		step = self.step
+		numpy.subtract(x, self.mean, delta)
+		numpy.divide(delta, self.count, step)
+		self.mean += step
+		# m2 += (x - old mean) * (x - new mean)
+		numpy.subtract(x, self.mean, step)
+		step *= delta
+		self.m2 += step
+
+	def variance(self):
+		'''Sample variance of the images added, zero before the second image.'''
+		if self.count < 2:
+			return numpy.zeros_like(self.m2)
+		return self.m2 / (self.count - 1)
+
+	def std(self):
+		return numpy.sqrt(self.variance())
+
+class AbsorptionStage(object):
+	"""
+	Groups the frames of a run into sequences by role and computes optical
+	density images with running statistics, see the module notes. stats
+	maps each role and 'od' to its RunningStats, od holds the optical
+	density of the last complete sequence. dropped counts the frames missed
+	in the current run.
+	"""
+
+	def __init__(self, roles = ('atoms', 'probe', 'dark'), minCounts = 1., numBuffers = 2, period_ms = None):
+		self.roles = tuple(roles)
+		self.minCounts = minCounts		# Lower bound of (atoms - dark) and (probe - dark).
+		self.numBuffers = numBuffers	# Sequences which may wait for the worker.
+		self.period_ms = period_ms		# Time between the frames of a sequence.
+		self.shape = None
+		self.stats = {}
+		self.sequences = 0
+		self.dropped = 0
+		self.error = None
+		self.thread = None
+
+	def allocate(self, shape):
+		'''Allocates all arrays for frames of the given shape.'''
+		self.shape = shape
+		n = len(self.roles)
+		self.buffers = [numpy.empty((n,) + shape, numpy.float32) for _ in range(self.numBuffers)]
+		self.stats = dict((name, RunningStats(shape)) for name in self.roles + ('od',))
+		self.od = numpy.zeros(shape, numpy.float32)
+		self.probe = numpy.empty(shape, numpy.float32)
+
+	def reset(self):
+		'''Clears the statistics of all runs so far.'''
+		for stats in self.stats.values():
+			stats.reset()
+		if self.shape is not None:
+			self.od.fill(0)
+		self.sequences = 0
+
+	def begin(self, PGC, numOfImages):
+		'''
+		Starts the worker for a new run. The statistics are kept from the
+		previous runs unless the image size changed.
+		'''
+		shape = (PGC.roi.height, PGC.roi.width)
+		if shape != self.shape:
+			self.allocate(shape)
+			self.sequences = 0
+		self.PGC = PGC
+		self.error = None
+		self.current = None
+		self.role = 0
+		self.dropped = 0
+		self.free = Queue()
+		for buf in self.buffers:
+			self.free.put(buf)
+		self.ready = Queue()
+		self.thread = Thread(target = self.work)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def framesLost(self, index):
+		'''Number of frames missed right before frame index of the run.'''
+		period = self.period_ms
+		if period is None:
+			period = self.PGC.runPeriod()
+		words = self.PGC.frameWords
+		if period is None or index == 0 or len(words) <= index:
+			return 0
+		times = decodeTimestamps(words[index - 1:index + 1])[3]
+		return max(int(round(1000. * (times[1] - times[0]) / period)) - 1, 0)
+
+	def process(self, index, frame):
+		'''Copies a frame into the buffer of its sequence.'''
+		n = len(self.roles)
+		role = self.role
+		lost = self.framesLost(index)
+		if lost:
+			self.dropped += lost
+			role = (role + lost) % n
+			if self.current is not None:
+				# The sequence lost a frame, the rest of it is not used.
+				self.free.put(self.current)
+				self.current = None
+		self.role = (role + 1) % n
+		if role == 0:
+			# Blocks while the worker is behind by numBuffers sequences.
+			self.current = self.free.get()
+		elif self.current is None:
+			return	# The rest of a sequence which lost a frame.
+		self.current[role] = frame
+		if role == n - 1:
+			self.ready.put(self.current)
+			self.current = None
+
+	def work(self):
+		'''Body of the worker thread.'''
+		while True:
+			buf = self.ready.get()
+			if buf is None:
+				return
+			try:
+				if self.error is None:
+					self.analyse(buf)
+			except Exception, err:
+				self.error = err
+			self.free.put(buf)
+
+	def analyse(self, buf):
+		'''Updates the statistics with one complete sequence.'''
+		roles = self.roles
+		frames = dict(zip(roles, buf))
+		for name in roles:
+			self.stats[name].add(frames[name])
+		if 'atoms' in frames and 'probe' in frames:
+			od = self.od
+			probe = self.probe
+			if 'dark' in frames:
+				numpy.subtract(frames['atoms'], frames['dark'], od)
+				numpy.subtract(frames['probe'], frames['dark'], probe)
+			else:
+				od[...] = frames['atoms']
+				probe[...] = frames['probe']
+			numpy.maximum(od, self.minCounts, od)
+			numpy.maximum(probe, self.minCounts, probe)
+			numpy.divide(od, probe, od)
+			numpy.log(od, od)
+			numpy.negative(od, od)
+			self.stats['od'].add(od)
+		self.sequences += 1
+
+	def end(self):
+		'''
+		Waits for the worker to process the last complete sequence. Frames of
+		an incomplete last sequence are ignored.
+		'''
+		if self.thread is None:
+			return
+		self.ready.put(None)
+		self.thread.join()
+		self.thread = None
+		if self.error is not None:
+			raise self.error
@@ -0,0 +1,96 @@
+'''
+Asyncio interface to the PointGreyController, for experiment sequencers
+driving the camera alongside other instruments from one event loop.
+
+Blocking driver calls (configuration, triggering, stopping) run on an
+executor with a single worker dedicated to the camera, so they are never
+issued concurrently. Frames are retrieved by the controller's streaming
+thread and waited for on a second single worker executor, so waiting for a
+frame never holds up a trigger.
+
+The module uses trollius, the asyncio port for Python 2, so coroutines are
+written with yield From(...):
+
+	camera = AsyncPointGreyController(PGC)
+	yield From(camera.start(numOfImages))
+	yield From(camera.trigger())
+	for future in camera.frames():
+		frame = yield From(future)
+		if frame is None:
+			break
+	yield From(camera.stop())
+'''
+
+import trollius as asyncio
+from trollius import From, Return
+from concurrent.futures import ThreadPoolExecutor
+
+class AsyncPointGreyController(object):
+	"""Wraps a PointGreyController so it can be driven from an event loop."""
+
+	def __init__(self, PGC, loop = None):
+		self.PGC = PGC
+		if loop is None:
+			loop = asyncio.get_event_loop()
+		self.loop = loop
+		self.driverExecutor = ThreadPoolExecutor(1)
+		self.frameExecutor = ThreadPoolExecutor(1)
+		self.done = False
+
+	def runDriver(self, func, *args):
+		'''Runs a blocking controller call on the driver executor.'''
+		return self.loop.run_in_executor(self.driverExecutor, func, *args)
+
+	@asyncio.coroutine
+	def start(self, numOfImages = None, queueSize = 4, numBuffers = 4):
+		'''
+		Readies the camera and starts streaming frames, see
+		PointGreyController.startStreaming.
+		'''
+		self.done = False
+		yield From(self.runDriver(self.PGC.startStreaming, numOfImages, queueSize, numBuffers))
+
+	@asyncio.coroutine
+	def trigger(self, timeout = None):
+		'''
+		Fires a software trigger once the camera is ready for it. Returns the
+		time in s spent waiting for the camera.
+		'''
+		waited = yield From(self.runDriver(self.PGC.fireSoftwareTrigger, timeout))
+		raise Return(waited)
+
+	@asyncio.coroutine
+	def nextFrame(self, timeout = None):
+		'''
+		Returns the next (index, image) pair of the run, or None once the
+		run is over.
+		'''
+		item = yield From(self.loop.run_in_executor(self.frameExecutor, self.PGC.nextImage, timeout))
+		if item is None:
+			self.done = True
+		raise Return(item)
+
+	def frames(self):
+		'''
+		Iterates over the frames of the run. Every item is a future resolving
+		to the next (index, image) pair; iteration ends after the future
+		resolving to None, which marks the end of the run. Each future has to
+		be waited for before the next one is asked for, otherwise a
+		RuntimeError is raised.
+		'''
+		future = None
+		while not self.done:
+			if future is not None and not future.done():
+				raise RuntimeError('Wait for the previous frame before asking for the next one.')
+			future = asyncio.async(self.nextFrame(), loop = self.loop)
+			yield future
+
+	@asyncio.coroutine
+	def stop(self):
+		'''Stops the camera and processes the images of the run.'''
+		yield From(self.runDriver(self.PGC.stop))
+
+	def close(self):
+		'''Shuts down the executors.'''
+		self.driverExecutor.shutdown()
+		self.frameExecutor.shutdown()
@@ -0,0 +1,248 @@
+'''
+Benchmarks full acquisition cycles of the PointGreyController across ROI
+sizes, pixel formats and image counts.
+
+Every cycle fires software triggers, then times the retrieval, conversion,
+timestamp extraction and saving of the images. The memory of a cycle is the
+peak resident memory of the process during it. On Linux the peak is reset
+before every cycle, elsewhere every cycle runs in a process of its own.
+Results are printed as a table and can be written as JSON so different
+versions can be compared.
+The simulated driver is used unless --hardware is given.
+
+Usage:
+	python PointGreyBenchmark.py --counts 4,16 --output results.json
+'''
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from PointGreyController import PointGreyController, ROI, setDriver
+from timeit import default_timer as timer
+
+# (width, height) of the regions of interest benchmarked, centered on the sensor.
+ROI_SIZES = [(1288, 964), (640, 480), (320, 240), (128, 128)]
+
+def processCounters():
+	'''Memory counters of the process on Windows, None if they can't be read.'''
+	from ctypes import windll, Structure, byref, sizeof, c_ulong, c_size_t
+	class counters(Structure):
+		_fields_ = [('cb', c_ulong), ('PageFaultCount', c_ulong)] + [(name, c_size_t) for name in
+			('PeakWorkingSetSize', 'WorkingSetSize', 'QuotaPeakPagedPoolUsage', 'QuotaPagedPoolUsage',
+			'QuotaPeakNonPagedPoolUsage', 'QuotaNonPagedPoolUsage', 'PagefileUsage', 'PeakPagefileUsage')]
+	c = counters()
+	c.cb = sizeof(c)
+	if not windll.psapi.GetProcessMemoryInfo(windll.kernel32.GetCurrentProcess(), byref(c), c.cb):
+		return None
+	return c
+
+def resetPeakMemory():
+	'''
+	Resets the peak resident memory of the process to its current resident
+	memory. Returns False where this isn't supported, which is everywhere but
+	on Linux.
+	'''
+	try:
+		clearRefs = open('/proc/self/clear_refs', 'w')
+		try:
+			clearRefs.write('5')
+		finally:
+			clearRefs.close()
+	except (IOError, OSError):
+		return False
+	return True
+
+def peakMemory():
+	'''Peak resident memory of the process in MB, None where unavailable.'''
+	if os.name == 'nt':
+		c = processCounters()
+		return c and c.PeakWorkingSetSize / 1048576.
+	try:
+		status = open('/proc/self/status')
+	except IOError:
+		pass
+	else:
+		try:
+			for line in status:
+				if line.startswith('VmHWM:'):
+					return int(line.split()[1]) / 1024.
+		finally:
+			status.close()
+	try:
+		import resource
+	except ImportError:
+		return None
+	# ru_maxrss is in bytes on OS X and in kB elsewhere.
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (sys.platform == 'darwin' and 1048576. or 1024.)
+
+def timed(func, times, name):
+	'''Wraps func so the time spent in each call is added to times[name].'''
+	def wrapper(*args, **kwargs):
+		start = timer()
+		try:
+			return func(*args, **kwargs)
+		finally:
+			times[name] = times.get(name, 0.) + timer() - start
+	return wrapper
+
+def runCycle(size, boostFramerate, numOfImages, expTime_ms, conversion, outdir, tuneBandwidth = False):
+	'''Runs one acquisition cycle and returns its measurements.'''
+	roi = ROI()
+	roi.setROICenter((644, 482), size[0], size[1])
+	resetPeakMemory()
+	PGC = PointGreyController(numOfImages, expTime_ms, 0, roi, boostFramerate, conversion = conversion,
+		tuneBandwidth = tuneBandwidth)
+	times = {}
+	for name in ('retrieveImages', 'convertImages', 'extractTimestamps'):
+		setattr(PGC, name, timed(getattr(PGC, name), times, name))
+	PGC.enableSoftwareTrigger()
+	PGC.setDataBuffers(numOfImages)
+	PGC.start()
+
+	latencies = []
+	first = timer()
+	for _ in range(numOfImages):
+		start = timer()
+		PGC.fireSoftwareTrigger()
+		latencies.append(timer() - start)
+	last = timer()
+	PGC.stop()
+	retrieved = last + times['retrieveImages']
+
+	start = timer()
+	PGC.saveRAWImages(os.path.join(outdir, 'raw_%03d.raw'))
+	times['saveRAWImages'] = timer() - start
+	start = timer()
+	PGC.savePNGImages(os.path.join(outdir, 'image_%03d.png'))
+	times['savePNGImages'] = timer() - start
+	done = timer()
+	memory = peakMemory()
+	PGC.close()
+
+	perFrame = dict((name, 1000. * t / numOfImages) for (name, t) in times.items())
+	return dict(
+		width = roi.width,
+		height = roi.height,
+		pixelFormat = boostFramerate and 'MONO8' or 'MONO16',
+		numOfImages = numOfImages,
+		conversion = conversion,
+		packetSize = PGC.packetSize,
+		achievableFrameRate = PGC.achievableFrameRate(),
+		triggerLatency_ms = dict(
+			mean = 1000. * sum(latencies) / len(latencies),
+			max = 1000. * max(latencies),
+			),
+		perFrame_ms = perFrame,
+		framesPerSecond = numOfImages / (retrieved - first),
+		triggerToDisk_ms = 1000. * (done - last),
+		peakMemory_MB = memory,
+		)
+
+def runIsolatedCycle(driverOptions, *args):
+	'''
+	Runs one acquisition cycle in a new process, started with the command line
+	options in driverOptions, and returns its measurements.
+	'''
+	command = [sys.executable, os.path.abspath(__file__), '--cycle', json.dumps(args)] + list(driverOptions)
+	output = subprocess.check_output(command)
+	# The controller may print warnings, the measurements are on the last line.
+	return json.loads(output.splitlines()[-1])
+
+def runSuite(counts, formats, sizes, expTime_ms, conversion, repeat, tuneBandwidth = False, isolate = None, driverOptions = ()):
+	'''
+	Runs every combination of the given settings and returns the results.
+	Each cycle runs in a process of its own if isolate is True, or if isolate
+	is None and the peak memory of this process can't be reset. driverOptions
+	are the command line options selecting the driver in those processes.
+	'''
+	if isolate is None:
+		isolate = not resetPeakMemory()
+	results = []
+	outdir = tempfile.mkdtemp(prefix = 'pgc_bench_')
+	try:
+		for size in sizes:
+			for boostFramerate in formats:
+				for numOfImages in counts:
+					for _ in range(repeat):
+						args = (size, boostFramerate, numOfImages, expTime_ms, conversion, outdir, tuneBandwidth)
+						if isolate:
+							results.append(runIsolatedCycle(driverOptions, *args))
+						else:
+							results.append(runCycle(*args))
+	finally:
+		shutil.rmtree(outdir)
+	return results
+
+def printResults(results):
+	print '%5s %4s %-6s %5s %8s %8s %8s %8s %8s %8s %8s %8s' % ('Width', 'Hgt', 'Format', 'N',
+		'Trig ms', 'Retr ms', 'Conv ms', 'TS ms', 'RAW ms', 'PNG ms', 'FPS', 'Peak MB')
+	for r in results:
+		p = r['perFrame_ms']
+		print '%5d %4d %-6s %5d %8.3f %8.3f %8.3f %8.3f %8.3f %8.3f %8.1f %8s' % (r['width'], r['height'],
+			r['pixelFormat'], r['numOfImages'], r['triggerLatency_ms']['mean'], p['retrieveImages'],
+			p['convertImages'], p['extractTimestamps'], p['saveRAWImages'], p['savePNGImages'],
+			r['framesPerSecond'], r['peakMemory_MB'] is None and '-' or '%.1f' % r['peakMemory_MB'])
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = 'Benchmark PointGreyController acquisition cycles.')
+	parser.add_argument('--counts', default = '4,16,64', help = 'comma separated image counts')
+	parser.add_argument('--formats', default = 'MONO8,MONO16', help = 'comma separated pixel formats')
+	parser.add_argument('--sizes', default = ','.join('%dx%d' % s for s in ROI_SIZES), help = 'comma separated ROI sizes, WIDTHxHEIGHT')
+	parser.add_argument('--exposure', type = float, default = 0.5, help = 'exposure time in ms')
+	parser.add_argument('--conversion', default = 'PASSTHROUGH', help = 'conversion policy of the controller')
+	parser.add_argument('--repeat', type = int, default = 1, help = 'cycles per combination')
+	parser.add_argument('--tune-bandwidth', action = 'store_true', help = 'use the largest packets at the fastest bus speed')
+	parser.add_argument('--frame-rate', type = float, default = 60., help = 'frame rate of the simulated camera')
+	parser.add_argument('--hardware', action = 'store_true', help = 'use the FlyCapture2 driver and a real camera')
+	parser.add_argument('--output', help = 'write results to this JSON file')
+	parser.add_argument('--profile', action = 'store_true', help = 'report driver call statistics')
+	parser.add_argument('--trace', help = 'write a trace of all driver calls to this file')
+	parser.add_argument('--isolate', action = 'store_true', help = 'run every cycle in a process of its own')
+	parser.add_argument('--cycle', help = argparse.SUPPRESS)
+	args = parser.parse_args()
+
+	if not args.hardware:
+		from PointGreySimDriver import SimulatedDriver
+		setDriver(SimulatedDriver(frameRate = args.frame_rate))
+	if args.cycle:
+		# A cycle run by runIsolatedCycle.
+		cycleArgs = json.loads(args.cycle)
+		cycleArgs[0] = tuple(cycleArgs[0])
+		print json.dumps(runCycle(*cycleArgs))
+		sys.exit()
+	driverOptions = args.hardware and ['--hardware'] or ['--frame-rate', repr(args.frame_rate)]
+	isolate = args.isolate or not resetPeakMemory()
+	counts = [int(c) for c in args.counts.split(',')]
+	formats = [f.strip().upper() == 'MONO8' for f in args.formats.split(',')]
+	sizes = [tuple(int(v) for v in s.split('x')) for s in args.sizes.split(',')]
+	stats = None
+	if args.profile or args.trace:
+		from PointGreyProfiler import enableProfiling, disableProfiling
+		stats = enableProfiling(args.trace)
+		if isolate:
+			print 'Driver calls of cycles run in their own process are not profiled.'
+	results = runSuite(counts, formats, sizes, args.exposure, args.conversion.upper(), args.repeat, args.tune_bandwidth,
+		isolate, driverOptions)
+	printResults(results)
+	if stats is not None:
+		disableProfiling()
+		print
+		print stats.report()
+	if args.output:
+		outfile = open(args.output, 'w')
+		json.dump(dict(
+			date = time.strftime('%Y-%m-%d %H:%M:%S'),
+			python = platform.python_version(),
+			platform = platform.platform(),
+			driver = args.hardware and 'FlyCapture2' or 'simulated',
+			results = results,
+			driverCalls = stats and stats.asDict(),
+			), outfile, indent = 1)
+		outfile.close()
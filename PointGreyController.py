@@ -7,134 +7,304 @@ PointGreyController class are linked to physical cameras. Methods to set camera
 parameters and execute its functions are available through its instance.
 
 Notes
-- The Region of Interest must be set when the controller is created.
+- The Region of Interest, pixel format, exposure time and gain can be changed
+  between runs with reconfigure(), without creating a new controller.
+- Controllers created with persistent = True stay connected after stop() and
+  can be re-armed with start() for any number of runs. close() disconnects
+  from the camera and reconnect() connects to it again.
+- Images stay allocated after stop() so they can be saved. close(), or
+  leaving a with block using the controller, frees them.
+- Controllers created with tuneBandwidth = True run the bus at the fastest
+  speed available and send images in the largest packets the camera accepts
+  for the region of interest, instead of at 50% speed. The frame rate this
+  allows is printed before every run, see achievableFrameRate.
 '''
 
 from PointGreyTypes import *
-from threading import Thread
+from PointGreyUtils import *
+from threading import Thread, Lock
+from Queue import Queue, Empty, Full
+from multiprocessing.pool import ThreadPool
+from array import array
 from ctypes import *
-from struct import pack, unpack
 from math import ceil
+from timeit import default_timer as timer
 import time
-from numpy import binary_repr
+import os
+import numpy
 
-FCDriver = CDLL('FlyCapture2_C')
+def loadDriver():
+	'''
+	Loads the FlyCapture2 driver. The simulated driver from PointGreySimDriver
+	is used instead of the vendor library if the PGC_DRIVER environment
+	variable is set to "simulated".
+	'''
+	if os.environ.get('PGC_DRIVER') == 'simulated':
+		from PointGreySimDriver import SimulatedDriver
+		return SimulatedDriver()
+	return CDLL('FlyCapture2_C')
+
+class LazyDriver(object):
+	"""
+	Stands in for the driver until it is first used, so the module can be
+	imported on machines without the FlyCapture2 library. The driver is
+	loaded by loadDriver on the first function looked up.
+	"""
+
+	def __init__(self):
+		self.driver = None
+
+	def __getattr__(self, name):
+		if self.driver is None:
+			self.driver = loadDriver()
+		func = getattr(self.driver, name)
+		if name.startswith('fc2'):
+			# Cache the function so later lookups skip __getattr__.
+			setattr(self, name, func)
+		return func
+
+def setDriver(driver):
+	'''
+	Replaces the driver backend used by all controllers, for example with a
+	PointGreySimDriver.SimulatedDriver.
+	'''
+	global FCDriver
+	FCDriver = driver
+
+FCDriver = LazyDriver()
 
 # FlyCapture2 C Documentation:
 # http://www.ptgrey.com/support/downloads/documents/flycapture/Doxygen/html/index.html
 
-# ----- Conversion Functions ----- #
+# ----- Timestamp Decoding ----- #
 
-def hexifier(fl):
+def timestampWords(images):
 	'''
-	Converts a floating point number into a number corresponding to its
-	hexadecimal/binary representation. Used to convert settings values for input
-	into the camera registers.
+	Returns the timestamps embedded in the first four bytes of each image
+	as an array of 32 bit words.
 	'''
-	# Taken from:
-	# http://stackoverflow.com/questions/1922771/python-obtain-manipulate-as-integers-bit-patterns-of-floats
-	s = pack('>f', fl)
-	''.join('%2.2x' % ord(c) for c in s)
-	i = unpack('>l', s)[0]
-	return i
-	
-def floatifier(h):
+	raw = numpy.empty((len(images), 4), numpy.uint8)
+	for i in range(len(images)):
+		raw[i] = images[i].pData[0:4]
+	return raw.view('>u4').ravel().astype(numpy.uint32)
+
+def decodeTimestamps(words):
 	'''
-	Converts a hexademical value returned by the camera registers to a floating
-	point number.
+	Decodes an array of embedded timestamp words in one pass. Returns the
+	seconds, cycle count and cycle offset fields along with the decoded time
+	in seconds. The seconds field is 7 bits wide and wraps every 128 s, the
+	decoded times are unwrapped assuming the words are roughly in
+	acquisition order.
 	'''
-	neg = h & 0x80000000
-	h = h & 0x7fffffff
-	s = pack('>l', h)
-	''.join('%2.2x' % ord(c) for c in s)
-	i = unpack('>f', s)[0]
-	if neg:
-		i = -i
-	return i
-	
-# ----- Region of Interest ----- #
-
-class ROIError(Exception):
-	"""For errors in setting the Region of Interest"""
-	def __init__(self, value, issueStr):
-		self.msg = issueStr + str(value)
-		
+	words = numpy.asarray(words, numpy.uint32)
+	seconds = words >> 25
+	count = (words >> 12) & 0x1FFF
+	offset = words & 0xFFF
+	times = seconds + (count + offset * Timestamp.countsPerOffset) * Timestamp.secondsPerCount
+	if len(times) > 1:
+		# Only steps back by more than half the range are wraps, smaller ones
+		# are frames out of order.
+		wraps = numpy.cumsum(numpy.diff(times) < -64)
+		times[1:] += 128 * wraps
+	return seconds, count, offset, times
+
+# ----- Frame Checks ----- #
+
+# Status of a frame, relative to the frame retrieved before it.
+FRAME_OK = 0
+FRAME_AFTER_DROP = 1	# One or more frames were missed before this one.
+FRAME_DUPLICATE = 2	# Same timestamp as the previous frame.
+FRAME_OUT_OF_ORDER = 3	# Earlier timestamp than the previous frame.
+FRAME_IRREGULAR = 4	# Interval is not a whole number of periods.
+
+class FrameReport(object):
+	"""
+	Result of checking the embedded timestamps of a run, see checkFrames.
+	status holds one of the FRAME_* codes per frame, intervals the time in
+	ms between each frame and the one before it.
+	"""
+
+	def __init__(self, status, intervals, period, dropped, peakRate, sustainedRate):
+		self.status = status
+		self.intervals = intervals
+		self.period_ms = period
+		self.dropped = dropped
+		self.peakRate_Hz = peakRate
+		self.sustainedRate_Hz = sustainedRate
+
+	def framesWith(self, status):
+		'''Indices of the frames with the given status.'''
+		return numpy.flatnonzero(self.status == status)
+
+	def ok(self):
+		'''Whether every frame arrived once, in order and on time.'''
+		return not self.status.any()
+
 	def __str__(self):
-		return repr(self.msg)
+		return ('%d frames, period %.3f ms: %d dropped, %d duplicated, %d out of order, '
+			'%d irregular; peak %.1f Hz, sustained %.1f Hz') % (len(self.status), self.period_ms,
+			self.dropped, len(self.framesWith(FRAME_DUPLICATE)), len(self.framesWith(FRAME_OUT_OF_ORDER)),
+			len(self.framesWith(FRAME_IRREGULAR)), self.peakRate_Hz, self.sustainedRate_Hz)
+
+def checkFrames(words, expectedPeriod_ms = None, tolerance = 0.25):
+	'''
+	Checks the embedded timestamp words of a run, in retrieval order, for
+	duplicated and out of order frames. If the expected trigger period is
+	given, also for missing frames (intervals of several periods) and for
+	intervals differing from a whole number of periods by more than
+	tolerance periods. Otherwise the median interval is reported as the
+	period, as frames triggered at irregular times are not an error. The
+	peak rate is that of the shortest interval, the sustained rate the mean
+	rate over the longest stretch of frames without any problem. Returns a
+	FrameReport.
+	'''
+	times = decodeTimestamps(words)[3]
+	n = len(times)
+	status = numpy.zeros(n, numpy.uint8)
+	intervals = numpy.diff(times)
+	if n < 2:
+		return FrameReport(status, intervals * 1000, expectedPeriod_ms or 0., 0, 0., 0.)
+	positive = intervals[intervals > 0]
+	following = status[1:]
+	dropped = 0
+	if expectedPeriod_ms is None:
+		period = len(positive) and numpy.median(positive)
+	else:
+		period = expectedPeriod_ms / 1000.
+		ratio = intervals / period
+		steps = numpy.rint(ratio)
+		onTime = abs(ratio - steps) <= tolerance
+		following[(intervals > 0) & ~(onTime & (steps >= 1))] = FRAME_IRREGULAR
+		drops = (intervals > 0) & onTime & (steps >= 2)
+		following[drops] = FRAME_AFTER_DROP
+		dropped = int((steps[drops] - 1).sum())
+	following[intervals == 0] = FRAME_DUPLICATE
+	following[intervals < 0] = FRAME_OUT_OF_ORDER
+	peakRate = len(positive) and 1. / positive.min() or 0.
+	# Longest stretch of consecutive good intervals.
+	good = numpy.concatenate(([0], following == FRAME_OK, [0])).astype(numpy.int8)
+	edges = numpy.flatnonzero(numpy.diff(good))
+	sustainedRate = 0.
+	if len(edges):
+		starts, ends = edges[0::2], edges[1::2]
+		longest = numpy.argmax(ends - starts)
+		duration = times[ends[longest]] - times[starts[longest]]
+		if duration > 0:
+			sustainedRate = (ends[longest] - starts[longest]) / duration
+	return FrameReport(status, intervals * 1000, period * 1000, dropped, peakRate, sustainedRate)
+
+# ----- Image Views ----- #
+
+# Numpy element type and channel count of the pixel formats images can be viewed in.
+pixelFormatLayout = {
+	fc2PixelFormat['MONO8'] : ('uint8', 1),
+	fc2PixelFormat['RAW8'] : ('uint8', 1),
+	fc2PixelFormat['MONO16'] : ('uint16', 1),
+	fc2PixelFormat['RAW16'] : ('uint16', 1),
+	fc2PixelFormat['RGB8'] : ('uint8', 3),
+	fc2PixelFormat['BGR'] : ('uint8', 3),
+	fc2PixelFormat['BGRU'] : ('uint8', 4),
+	fc2PixelFormat['BGR16'] : ('uint16', 3),
+}
+
+def imageView(im):
+	'''
+	Returns a numpy array viewing the pixel data of an fc2Image without
+	copying it. The view shares memory with the driver, so it is only valid
+	until the image is retrieved into or converted into again, or destroyed.
+	'''
+	if not im.pData:
+		raise ValueError('Image holds no data.')
+	try:
+		dtype, channels = pixelFormatLayout[im.format]
+	except KeyError:
+		raise ValueError('Pixel format 0x%08x can not be viewed.' % im.format)
+	dtype = numpy.dtype(dtype)
+	rows = im.rows
+	stride = im.stride
+	buf = (c_ubyte * (rows * stride)).from_address(addressof(im.pData.contents))
+	if channels == 1:
+		shape = (rows, im.cols)
+		strides = (stride, dtype.itemsize)
+	else:
+		shape = (rows, im.cols, channels)
+		strides = (stride, channels * dtype.itemsize, dtype.itemsize)
+	return numpy.ndarray(shape, dtype, buf, 0, strides)
+
+# ----- Image Buffers ----- #
+
+class ImageBufferPool(object):
+	"""
+	Owns the fc2Image objects used by a controller. Images are kept in named
+	sets which are created once and reused from run to run, growing or
+	shrinking as the number of images changes. Changing the key (image size
+	and pixel formats) frees all images, as their memory no longer fits.
+	"""
 
-class ROI(object):
-	"""Defines the region of interest of the camera."""
-	
 	def __init__(self):
-		self.posLeft = 0
-		self.posTop = 0
-		self.width = 1288
-		self.height = 964
-	
-	def __str__(self):
-		return 'Left: %d, Top: %d, Width: %d, Height: %d' % (self.posLeft, self.posTop, self.width, self.height)
-	
-	def checkValues(self):
-		"""Verifies validity of ROI Values for Flea2 Camera."""
-		posTop = self.posTop	#Pixels from left to start ROI.
-		posLeft = self.posLeft	#Pixels from top to start ROI.
-		width = self.width		#Width (in pixels) of the ROI.
-		height = self.height	#Height (in pixels) of the ROI.
-		if not(0 <= posTop < 964):
-			raise ROIError(posTop, 'Top must be between 0 and 964. Currently ') 
-		if not(0 <= posLeft < 1288):
-			raise ROIError(posLeft, 'Left must be between 0 and 1288. Currently ')
-		if not(0 <= width <= 1288):
-			raise ROIError(width, 'Width must be between 0 and 1288. Currently ') 
-		if not(0 <= height <= 964):
-			raise ROIError(posTop, 'Height must be between 0 and 964. Currently ') 
-		if not(0 < posTop + height <= 964):
-			raise ROIError(posTop + height, 'Top + height must be <= 964. Currently ')
-		if not(0< posLeft + width <= 1288):
-			raise 0 < ROIError(posLeft + width, 'Left + width must be <=1288. Currently ')
-	
-	def setROI(self, posLeft, posTop, width, height):
-		"""Sets the ROI parameters explicitly."""
-		self.posLeft = posLeft - posLeft % 2	#Pixels from left to start ROI.
-		self.posTop = posTop - posTop % 2  #Pixels from top to start ROI.
-		self.width = int(ceil(width / 8.) * 8) 	#Width (in pixels) of the ROI.
-		self.height = height + height % 2		#Height (in pixels) of the ROI.
-		self.checkValues()
-	
-	def setROICenter(self, center, width, height):
-		"""
-		Sets the ROI parameters based on where the image center should be along
-		with the width and height. center is a tuple of the form (x, y).
-		"""
-		x = center[0]
-		y = center[1]
-		self.width = int(ceil(width / 8.) * 8) 	#Width (in pixels) of the ROI.
-		self.height = height + height % 2		#Height (in pixels) of the ROI.
-		hWidth = self.width/2
-		hHeight = self.height/2
-		l = x - hWidth
-		t = y - hHeight
-		self.posLeft = l - l % 2
-		self.posTop = t - t % 2
-		self.checkValues()	
-
-# ----- Timestamp ----- #
-
-class Timestamp(object):
-	"""Used to store and decode image timestamps."""
-
-	secondsPerCount = 1./8000.
-	countsPerOffset = 1./3072.
-	
-	def __init__(self, s, c, o):
-		self.seconds = s
-		self.count = c
-		self.offset = o
-	
-	def decodeTime(self):
-		"""Converts timestamp to time in seconds based on FlyCapture Documentation."""
-		return self.seconds + (self.count+self.offset*self.countsPerOffset)*self.secondsPerCount
-		
+		self.key = None
+		self.sets = {}
+
+	def setKey(self, key):
+		'''Sets the image size and formats the pooled images are used for.'''
+		if key != self.key:
+			self.clear()
+			self.key = key
+
+	def acquire(self, name, numOfImages):
+		'''Returns the named set of images, resized to numOfImages images.'''
+		images = self.sets.setdefault(name, [])
+		while len(images) > numOfImages:
+			im = images.pop()
+			handleError(FCDriver.fc2DestroyImage(byref(im)))
+		while len(images) < numOfImages:
+			im = fc2Image()
+			handleError(FCDriver.fc2CreateImage(byref(im)))
+			images.append(im)
+		return images
+
+	def release(self, name):
+		'''Destroys the named set of images.'''
+		for im in self.sets.pop(name, []):
+			handleError(FCDriver.fc2DestroyImage(byref(im)))
+
+	def clear(self):
+		'''Destroys all pooled images, freeing their memory.'''
+		for images in self.sets.values():
+			for im in images:
+				handleError(FCDriver.fc2DestroyImage(byref(im)))
+		self.sets = {}
+
+# ----- Image Saving ----- #
+
+# Threads encoding and saving images, shared by all controllers so that
+# controllers which are never closed do not leave idle threads behind.
+saveWorkers = 4
+savePool = None
+savePoolLock = Lock()
+
+def getSavePool():
+	'''Returns the shared save pool, creating it on first use.'''
+	global savePool
+	with savePoolLock:
+		if savePool is None:
+			savePool = ThreadPool(saveWorkers)
+		return savePool
+
+def setSaveWorkers(numOfWorkers):
+	'''
+	Sets the number of threads saving images. The current pool finishes the
+	saves already queued on it and is replaced on the next save.
+	'''
+	global saveWorkers, savePool
+	if numOfWorkers < 1:
+		raise ValueError('At least one save worker is needed.')
+	with savePoolLock:
+		saveWorkers = numOfWorkers
+		if savePool is not None:
+			savePool.close()
+			savePool = None
+
 # ----- Point Grey Controller ----- #
 
 def handleError(errorCode):
@@ -147,10 +317,21 @@ def handleError(errorCode):
 	if errorCode:
 		raise flyCaptureError(errorCode)
 		
+def getNumOfCameras():
+	'''Returns the number of cameras connected to the computer.'''
+	context = fc2Context()
+	handleError(FCDriver.fc2CreateContext(byref(context)))
+	num = c_uint()
+	try:
+		handleError(FCDriver.fc2GetNumOfCameras(context, byref(num)))
+	finally:
+		handleError(FCDriver.fc2DestroyContext(context))
+	return num.value
+		
 class propertyError(Exception):
 	"""For errors when setting camera property values"""
 	def __init__(self, name, value, min, max, units):
-		msg = '%s %f %s is outside of range %f to %f.' % (name, value, units, min, max)
+		self.msg = '%s %f %s is outside of range %f to %f.' % (name, value, units, min, max)
 		
 	def __str__(self):
 		return repr(self.msg)		
@@ -164,20 +345,196 @@ class flyCaptureError(Exception):
 	def __str__(self):
 		return repr(self.msg)
 	
+class triggerError(Exception):
+	'''For when the camera does not become ready for triggering in time'''
+	def __init__(self, waited):
+		self.waited = waited
+		self.msg = 'Camera was not ready to be triggered after %.3f s.' % waited
+		
+	def __str__(self):
+		return repr(self.msg)
+	
+def raiseTimerResolution():
+	'''
+	Sets the system timer resolution to 1 ms on Windows, where sleeps are
+	otherwise rounded up to the 15.6 ms system tick. Returns a function
+	undoing the change.
+	'''
+	if os.name != 'nt':
+		return lambda: None
+	try:
+		windll.winmm.timeBeginPeriod(1)
+	except (AttributeError, OSError):
+		return lambda: None
+	return lambda: windll.winmm.timeEndPeriod(1)
+
+def raiseThreadPriority():
+	'''
+	Best effort attempt to run the calling thread at time critical priority
+	with a 1 ms system timer resolution, so sleeps end on time. Only done on
+	Windows. Returns a function undoing the timer resolution change.
+	'''
+	if os.name != 'nt':
+		return lambda: None
+	try:
+		kernel32 = windll.kernel32
+		kernel32.SetThreadPriority(kernel32.GetCurrentThread(), 15)	# THREAD_PRIORITY_TIME_CRITICAL
+	except (AttributeError, OSError):
+		return lambda: None
+	return raiseTimerResolution()
+
+class TriggerSchedule(object):
+	"""
+	Software triggers fired at set times by a dedicated thread, see
+	PointGreyController.scheduleTriggers. Times are in s since start, a
+	timer() value. fired holds the time each trigger was fired at (nan
+	until it is), waits the time spent waiting for the camera to be ready.
+	"""
+
+	def __init__(self, PGC, times, start, spin):
+		self.PGC = PGC
+		self.requested = numpy.asarray(times, numpy.float64)
+		self.fired = numpy.empty(len(self.requested))
+		self.fired.fill(numpy.nan)
+		self.waits = numpy.zeros(len(self.requested))
+		self.start = start
+		self.spin = spin	# Time before each trigger (s) spent spinning on the clock instead of sleeping.
+		self.error = None
+		self.thread = Thread(target = self.run)
+		self.thread.daemon = True
+
+	def run(self):
+		'''Body of the trigger thread.'''
+		restore = raiseThreadPriority()
+		PGC = self.PGC
+		context = PGC.context
+		start = self.start
+		spin = self.spin
+		try:
+			for i in range(len(self.requested)):
+				target = start + self.requested[i]
+				self.waits[i] = PGC.waitForTrigger()
+				remaining = target - timer()
+				if remaining > spin:
+					time.sleep(remaining - spin)
+				while timer() < target:
+					pass
+				self.fired[i] = timer() - start
+				handleError(FCDriver.fc2FireSoftwareTrigger(context))
+		except Exception, err:
+			self.error = err
+		finally:
+			restore()
+
+	def wait(self, timeout = None):
+		'''Waits until the last trigger is fired. Re-raises any error of the trigger thread.'''
+		self.thread.join(timeout)
+		if self.error is not None:
+			raise self.error
+
+	def done(self):
+		'''Whether the schedule has finished.'''
+		return not self.thread.isAlive()
+
+	def errors(self):
+		'''Actual minus requested fire times in s, nan for triggers not fired.'''
+		return self.fired - self.requested
+
+	def __str__(self):
+		errors = self.errors()
+		errors = errors[~numpy.isnan(errors)]
+		if not len(errors):
+			return '0 of %d triggers fired' % len(self.requested)
+		return '%d of %d triggers fired, timing error mean %.1f us, max %.1f us, std %.1f us' % (len(errors),
+			len(self.requested), 1e6 * errors.mean(), 1e6 * abs(errors).max(), 1e6 * errors.std())
+
 class PointGreyController(object):
 	
-	def __init__(self, numOfImages = 5, expTime_ms = 15, gain = 0, roi = ROI(), boostFramerate = False):
+	# Absolute minimum and maximum of the shutter and gain.
+	limitRegisters = (0x910, 0x914, 0x920, 0x924)
+	# Registers with side effects which are never cached.
+	uncachedRegisters = (fc2Register['Initialize'], fc2Register['Power'], fc2Register['SoftwareTrigger'])
+	
+	# Pixel formats images can be converted to after retrieval. PASSTHROUGH
+	# keeps them in the format delivered by the camera.
+	conversionPolicies = ('PASSTHROUGH', 'MONO8', 'MONO16', 'BGR')
+	
+	# Pool names of the raw and converted images of the two sets of data
+	# buffers, see swapDataBuffers.
+	dataBufferNames = (('raw', 'converted'), ('raw2', 'converted2'))
+	
+	def __init__(self, numOfImages = 5, expTime_ms = 15, gain = 0, roi = ROI(), boostFramerate = False, cameraIndex = 0, conversion = 'PASSTHROUGH', persistent = False, tuneBandwidth = False):
+		if conversion not in self.conversionPolicies:
+			raise ValueError('Conversion must be one of %s.' % ', '.join(self.conversionPolicies))
 		self.numOfImages = numOfImages
+		self.cameraIndex = cameraIndex
+		self.conversion = conversion
 		self.roi = roi
 		self.boostFramerate = boostFramerate
+		self.persistent = persistent	# Keep the camera connected after stop().
+		self.tuneBandwidth = tuneBandwidth	# Use the largest packets at the fastest bus speed.
+		self.packetSize = None			# Bytes per isochronous packet, see setImageSettings.
+		self.imageSettings = None		# Format7 settings applied to the camera.
+		self.requestedSettings = None	# Exposure time and gain as requested, before the camera rounds them.
+		self.format7Info = None
+		self.connected = False
+		self.capturing = False
+		self.streaming = False
+		self.triggerSource = None
+		self.stages = []	# Per frame processing stages, see attachStage.
+		
+		# Polling used while waiting for the camera to be ready for a trigger.
+		self.triggerPollInterval = 0.0001	# Initial interval (s), doubled after every poll.
+		self.triggerPollMax = 0.002			# Longest interval (s) between polls.
+		self.triggerTimeout = None			# Default timeout (s), None waits forever.
+		self.triggerWaits = []
 		
+		# Longest time (s) stopStreaming waits for a frame still missing from
+		# a streamed run, None waits forever.
+		self.streamTimeout = 1.
+		
+		# Checks of the frames retrieved in each run, see checkRun.
+		self.expectedPeriod_ms = None	# Trigger period, None skips the timing checks.
+		self.schedulePeriod_ms = None	# Period of the triggers scheduled in this run.
+		self.frameTolerance = 0.25		# Allowed deviation from the period, in periods.
+		self.frameWords = []
+		self.frameReport = None
+		self.retrievalLatencies = []	# Time (s) retrieving each frame took.
+		
+		# Saves of images still being written, see saveImages.
+		self.pendingSaves = []
+		
+		# Images used by the controller, reused from run to run.
+		self.bufferPool = ImageBufferPool()
+		self.bufferSet = 0		# Set of data buffers in use, see swapDataBuffers.
+		self.rawImageData = []
+		self.conImageData = []
+		
+		# Register values known to be held by the camera, see getRegister.
+		self.registerCache = {}
+		self.pendingWrites = None
+		self.pendingOrder = []
+		
+		self.connect()
+		self.configure(expTime_ms, gain)
+	
+	def connect(self):
+		'''Creates a context and connects it to the camera.'''
 		context = fc2Context()
 		handleError(FCDriver.fc2CreateContext(byref(context)))		
 		self.context = context
 		guid = fc2PGRGuid()
-		handleError(FCDriver.fc2GetCameraFromIndex(context, 0, byref(guid)))
+		handleError(FCDriver.fc2GetCameraFromIndex(context, self.cameraIndex, byref(guid)))
 		self.guid = guid
 		handleError(FCDriver.fc2Connect(context, byref(guid)))
+		self.connected = True
+		
+	def configure(self, expTime_ms, gain):
+		'''
+		Resets the camera and applies the controller settings, the region of
+		interest and the given exposure time and gain.
+		'''
+		roi = self.roi
 		
 		# Re-initialize and re-power camera.
 		self.setRegister(fc2Register['Initialize'], 0x80000000)
@@ -190,6 +547,7 @@ class PointGreyController(object):
 		self.setImageSettings(roi)
 		
 		# Disables unused camera settings.
+		self.queueRegisterWrites()
 		self.setRegister(fc2Register['AutoExposure'], 0x40000000)
 		self.setRegister(fc2Register['Sharpness'], 0x40000000) 
 		self.setRegister(fc2Register['Gamma'], 0x40000000) 
@@ -198,53 +556,246 @@ class PointGreyController(object):
 
 		# Initialize Gain and Shutter settings.
 		self.setRegister(fc2Register['Gain'], 0x42000000)
-		self.setGain(gain)
 		self.setRegister(fc2Register['Shutter'], 0x42000000)
+		self.flushRegisterWrites()
+		self.setGain(gain)
 		self.setExposureTime(expTime_ms)
 		self.expTime_ms = self.getExposureTime()
 		self.gain = self.getGain()
+		self.requestedSettings = (expTime_ms, gain)
+		
+		# Restore the trigger mode lost in the reset.
+		if self.triggerSource is not None:
+			self.setTriggerMode(self.triggerSource)
 		
 	def start(self):
-		'''Readies camera to capture images when triggered.'''
+		'''
+		Readies camera to capture images when triggered. Images of the
+		previous run may still be being saved, frames are only retrieved into
+		them once that is done, see retrieveImages.
+		'''
 		self.setConfig(self.numOfImages)
+		self.reportFrameRate()
 		context = self.context
 		handleError(FCDriver.fc2StartCapture(context))
+		self.capturing = True
 		self.clearBuffer()
+		self.triggerWaits = []
+		self.schedulePeriod_ms = None
+		self.beginStages(self.numOfImages)
 		
 	def stop(self):
-		'''Stop collecting images and disassociate context from camera.'''
+		'''
+		Stop collecting images and disassociate context from camera. In
+		persistent mode the camera stays connected and configured, so the
+		controller can be re-armed with start() for the next run. Otherwise
+		only the images of the run are kept, for saving, until close().
+		'''
 		context = self.context
-		self.processData()
+		if self.streaming:
+			self.stopStreaming()
+		else:
+			self.processData()
 		handleError(FCDriver.fc2StopCapture(context))
-		handleError(FCDriver.fc2DestroyContext(context))
+		self.capturing = False
+		try:
+			self.checkRun()
+			for stage in self.stages:
+				stage.end()
+		finally:
+			# Done even if a stage failed, so the camera is not left connected.
+			if not self.persistent:
+				self.disconnect()
+				self.bufferPool.release('ring')
+				self.bufferPool.release('scratch')
+	
+	def disconnect(self):
+		'''Stops any capture and disassociates the context from the camera.'''
+		if not self.connected:
+			return
+		if self.capturing:
+			if self.streaming:
+				# Abandon the run rather than wait for the remaining images.
+				self.streamCount = None
+				self.stopStreaming()
+			handleError(FCDriver.fc2StopCapture(self.context))
+			self.capturing = False
+		handleError(FCDriver.fc2DestroyContext(self.context))
+		self.connected = False
+	
+	def close(self):
+		'''
+		Disconnects from the camera and frees all images once pending saves
+		are done. Called on leaving a with block using the controller.
+		'''
+		self.disconnect()
+		self.freeBuffers()
+	
+	def __enter__(self):
+		return self
+	
+	def __exit__(self, excType, excValue, traceback):
+		self.close()
+	
+	def reconnect(self):
+		'''
+		Connects to the camera again, after close() or a lost connection,
+		and restores the settings of the controller.
+		'''
+		self.disconnect()
+		self.invalidateRegisters()
+		self.connect()
+		self.configure(self.expTime_ms, self.gain)
+	
+	def reconfigure(self, roi = None, boostFramerate = None, expTime_ms = None, gain = None):
+		'''
+		Changes the region of interest, pixel format (boostFramerate),
+		exposure time and gain between runs without resetting the camera.
+		Settings left as None are kept. Only the Format7 settings and
+		registers which differ from the current ones are written, and data
+		buffers set up for a different image size or format are set up
+		again, releasing the images of the previous run.
+		'''
+		if self.capturing:
+			raise flyCaptureError(31)	# Isochronous transfer has already been started.
+		if roi is not None:
+			roi.checkValues()
+			self.roi = roi
+		if boostFramerate is not None:
+			self.boostFramerate = boostFramerate
+		if expTime_ms is None:
+			expTime_ms = self.expTime_ms
+		if gain is None:
+			gain = self.gain
+		if not self.connected:
+			# Applied by configure() once connected again.
+			self.expTime_ms = expTime_ms
+			self.gain = gain
+			return
+		roi = self.roi
+		imageSettings = (roi.posLeft, roi.posTop, roi.width, roi.height, self.nativePixelFormat())
+		resized = imageSettings != self.imageSettings
+		if resized:
+			self.setImageSettings(roi)
+		# Unchanged register values are not written again, see setRegister.
+		self.setExposureTime(expTime_ms)
+		self.setGain(gain)
+		self.expTime_ms = self.getExposureTime()
+		self.gain = self.getGain()
+		self.requestedSettings = (expTime_ms, gain)
+		if resized and self.rawImageData:
+			self.setDataBuffers(len(self.rawImageData))
 	
 	def setDataBuffers(self, numOfImages):
-		'''Sets up the data buffers to which the camera will save data. '''
-		self.timestamps = [float()]*numOfImages
-		self.rawImageData = [self.initializeImage() for _ in range(numOfImages)]
-		self.conImageData = [self.initializeImage() for _ in range(numOfImages)]
+		'''
+		Sets up the data buffers to which the camera will save data. The
+		images are taken from the buffer pool, so the images of the previous
+		run are reused once any pending saves of them have finished. No
+		buffers are set up for converted images if the images are not
+		converted, conImageData then holds the raw images.
+		'''
+		pool = self.bufferPool
+		roi = self.roi
+		key = (roi.width, roi.height, self.nativePixelFormat(), self.conversionFormat())
+		if key == pool.key:
+			self.waitForSaves(self.bufferSet)
+		else:
+			# All pooled images are freed.
+			self.waitForSaves()
+		pool.setKey(key)
+		self.timestamps = numpy.zeros(numOfImages)
+		(raw, converted) = self.dataBufferNames[self.bufferSet]
+		self.rawImageData = pool.acquire(raw, numOfImages)
+		if self.conversionFormat() is None:
+			self.conImageData = self.rawImageData
+		else:
+			self.conImageData = pool.acquire(converted, numOfImages)
+	
+	def swapDataBuffers(self, numOfImages):
+		'''
+		Switches to the other of the two sets of data buffers, so frames can
+		be retrieved while the images of the previous run are still being
+		saved. Waits for pending saves of the other set.
+		'''
+		self.bufferSet = 1 - self.bufferSet
+		self.setDataBuffers(numOfImages)
+	
+	def freeBuffers(self):
+		'''
+		Frees all images held by the controller once pending saves are done.
+		The data buffers have to be set up again before the next run.
+		'''
+		self.waitForSaves()
+		self.bufferPool.clear()
+		self.bufferSet = 0
+		self.rawImageData = []
+		self.conImageData = []
 		
 # ----- Save Functions
 	
-	def saveRAWImages(self, fNameFormat = 'rawImage_%03d.raw'):
-		'''Saves the images collected in raw format.'''
-		images = self.conImageData
-		for i in range(len(images)):
-			im = images[i]
-			fname = fNameFormat % i
-			fname = c_char_p(fname)
-			handleError(FCDriver.fc2SaveImage(byref(im), fname, fc2ImageFileFormat['RAW']))	
+	def saveRAWImages(self, fNameFormat = 'rawImage_%03d.raw', wait = True, callback = None):
+		'''Saves the images collected in raw format, see saveImages.'''
+		return self.saveImages(fNameFormat, 'RAW', wait, callback)
 		
-	def savePNGImages(self, fNameFormat = 'image_%03d.png'):
-		'''Save the images collected in png format.'''
-		images = self.conImageData
-		for i in range(len(images)):
-			im = images[i]
+	def savePNGImages(self, fNameFormat = 'image_%03d.png', wait = True, callback = None):
+		'''Save the images collected in png format, see saveImages.'''
+		return self.saveImages(fNameFormat, 'PNG', wait, callback)
+	
+	def saveImages(self, fNameFormat, fileFormat, wait = True, callback = None):
+		'''
+		Saves the images collected in the given fc2ImageFileFormat. The images
+		are encoded and written in parallel by the threads of the shared save
+		pool, see setSaveWorkers. Unless wait is set the call returns
+		immediately with an AsyncResult, so the next run can start while the
+		images are being written; callback is called with the list of file
+		names once all of them have been saved.
+		'''
+		images = list(self.conImageData)
+		fileFormat = fc2ImageFileFormat[fileFormat]
+		def save(i):
 			fname = fNameFormat % i
-			fname = c_char_p(fname)
-			handleError(FCDriver.fc2SaveImage(byref(im), fname, fc2ImageFileFormat['PNG']))	
+			handleError(FCDriver.fc2SaveImage(byref(images[i]), c_char_p(fname), fileFormat))
+			return fname
+		result = getSavePool().map_async(save, range(len(images)), callback = callback)
+		self.pendingSaves.append((self.bufferSet, result))
+		if wait:
+			self.waitForSaves()
+		return result
+	
+	def waitForSaves(self, bufferSet = None):
+		'''
+		Waits until all images queued by saveImages have been written, or
+		only those of the given set of data buffers. The first error raised
+		while saving is re-raised.
+		'''
+		pending = [save for save in self.pendingSaves if bufferSet in (None, save[0])]
+		self.pendingSaves = [save for save in self.pendingSaves if save not in pending]
+		for (saved, result) in pending:
+			result.get()
+	
+	def savesPending(self, bufferSet = None):
+		'''Whether images of the given set of data buffers (any by default) are still being saved.'''
+		return any(not result.ready() for (saved, result) in self.pendingSaves if bufferSet in (None, saved))
+		
+	def saveRun(self, fpath = 'run.npz', compression = False):
+		'''
+		Saves all images of the run along with their timestamps and the
+		camera settings into a single .npz or .h5 file, see PointGreyWriter.
+		'''
+		from PointGreyWriter import saveRun
+		self.waitForSaves()
+		saveRun(self, fpath, compression)
 		
-	def saveLog(self, fpath = 'log.txt'):
+	def saveLog(self, fpath = 'log.pgl'):
+		'''
+		Appends the timestamps, retrieval latencies and frame checks of the
+		run along with the camera settings to a binary run log, see
+		PointGreyRunLog. Returns the number of the run in the log.
+		'''
+		from PointGreyRunLog import appendRun
+		return appendRun(self, fpath)
+	
+	def saveTextLog(self, fpath = 'log.txt'):
 		"""Creates and saves a log file for the image collection run"""
 		timestamps = self.timestamps
 		outfile = open(fpath, 'w')
@@ -267,10 +818,13 @@ class PointGreyController(object):
 		t = 1000. * floatifier(t)
 		return t
 	
+	def getExposureLimits(self):
+		'''Returns the minimum and maximum exposure time of the camera in ms.'''
+		return 1000 * floatifier(self.getRegister(0x910)), 1000 * floatifier(self.getRegister(0x914))
+	
 	def setExposureTime(self, ms):
 		'''Set camera exposure time. Input is in ms.'''
-		min = 1000 * floatifier(self.getRegister(0x910))
-		max = 1000 * floatifier(self.getRegister(0x914))
+		(min, max) = self.getExposureLimits()
 		if min < ms < max:
 			s = float(ms / 1000.)
 			s = hexifier(s)
@@ -284,10 +838,13 @@ class PointGreyController(object):
 		g = floatifier(g)
 		return g
 		
+	def getGainLimits(self):
+		'''Returns the minimum and maximum gain of the camera in db.'''
+		return floatifier(self.getRegister(0x920)), floatifier(self.getRegister(0x924))
+	
 	def setGain(self, db):
 		'''Set camera gain leve in db.'''
-		min = floatifier(self.getRegister(0x920))
-		max = floatifier(self.getRegister(0x924))
+		(min, max) = self.getGainLimits()
 		if min < db < max:
 			db = float(db)
 			db = hexifier(db)
@@ -304,22 +861,74 @@ class PointGreyController(object):
 		return img
 	
 	def retrieveImages(self):
-		'''Retrieves all of the images collected by the camera.'''
+		'''
+		Retrieves all of the images collected by the camera, once pending
+		saves of the images of the previous run are done.
+		'''
+		self.waitForSaves(self.bufferSet)
 		context = self.context
 		rawDat = self.rawImageData
+		words = self.frameWords = array('I')
+		latencies = self.retrievalLatencies = array('d')
 		for i in range(len(rawDat)):
 			im = rawDat[i]
+			start = timer()
 			handleError(FCDriver.fc2RetrieveBuffer(context, byref(im)))
+			latencies.append(timer() - start)
+			# Recorded before the stages see the frame, as while streaming.
+			d = im.pData
+			words.append((d[0] << 24) | (d[1] << 16) | (d[2] << 8) | d[3])
+			for stage in self.stages:
+				stage.process(i, imageView(im))
 		
 	def convertImages(self):
 		'''
-		Converts all the images collected by the camera based on the BGR
-		pixel format.
+		Converts all the images collected by the camera to the pixel format
+		selected by the conversion policy. Does nothing if the images are
+		kept in their native format.
 		'''
+		pixelFormat = self.conversionFormat()
 		rawDat = self.rawImageData
 		conDat = self.conImageData
+		if pixelFormat is None or conDat is rawDat:
+			return
 		for i in range(len(rawDat)):
-			handleError(FCDriver.fc2ConvertImageTo(fc2PixelFormat['BGR'], byref(rawDat[i]), byref(conDat[i])))
+			handleError(FCDriver.fc2ConvertImageTo(pixelFormat, byref(rawDat[i]), byref(conDat[i])))
+
+	def nativePixelFormat(self):
+		'''Pixel format the camera delivers images in.'''
+		if self.boostFramerate:
+			return fc2PixelFormat['MONO8']
+		return fc2PixelFormat['MONO16']
+
+	def conversionFormat(self):
+		'''
+		Pixel format images are converted to under the conversion policy, or
+		None if they are kept in the format the camera delivers them in.
+		'''
+		if self.conversion == 'PASSTHROUGH':
+			return None
+		pixelFormat = fc2PixelFormat[self.conversion]
+		if pixelFormat == self.nativePixelFormat():
+			return None
+		return pixelFormat
+
+	def getImageView(self, i, converted = False):
+		'''
+		Returns image i of the run as a numpy array sharing memory with the
+		driver, see imageView. Raw images are returned unless converted is set.
+		'''
+		if converted:
+			return imageView(self.conImageData[i])
+		return imageView(self.rawImageData[i])
+
+	def getImageViews(self, converted = False):
+		'''Returns numpy views of all of the images of the run.'''
+		if converted:
+			images = self.conImageData
+		else:
+			images = self.rawImageData
+		return [imageView(im) for im in images]
 
 	def setImageSettings(self, roi):
 		'''Used to set custom image sizes.'''
@@ -330,46 +939,337 @@ class PointGreyController(object):
 		imSet.offsetY = roi.posTop
 		imSet.width = roi.width
 		imSet.height = roi.height
-		if self.boostFramerate:
-			imSet.pixelFormat = fc2PixelFormat['MONO8']
+		imSet.pixelFormat = self.nativePixelFormat()
+		if self.tuneBandwidth:
+			# The packet sizes allowed depend on the bus speed, so it is set first.
+			self.setConfig(self.numOfImages)
+			packetInfo = self.validateImageSettings(imSet)
+			packetSize = c_uint(packetInfo.maxBytesPerPacket)
+			handleError(FCDriver.fc2SetFormat7ConfigurationPacket(context, byref(imSet), packetSize))
 		else:
-			imSet.pixelFormat = fc2PixelFormat['MONO16'] 
-		percentSpeed = c_float(50)
-		handleError(FCDriver.fc2SetFormat7Configuration(context, byref(imSet), percentSpeed))
+			percentSpeed = c_float(50)
+			handleError(FCDriver.fc2SetFormat7Configuration(context, byref(imSet), percentSpeed))
+		self.packetSize = self.getPacketSize()
+		self.imageSettings = (roi.posLeft, roi.posTop, roi.width, roi.height, self.nativePixelFormat())
+		# The shutter range depends on the frame rate the image size allows.
+		self.invalidateRegisters(self.limitRegisters)
+
+	def validateImageSettings(self, imSet):
+		'''
+		Checks Format7 image settings against the limits of the camera.
+		Raises a ROIError if the camera does not support them, otherwise
+		returns the packet sizes (fc2Format7PacketInfo) it allows for them.
+		'''
+		context = self.context
+		info = fc2Format7Info()
+		info.mode = imSet.mode
+		supported = c_int()
+		handleError(FCDriver.fc2GetFormat7Info(context, byref(info), byref(supported)))
+		if not supported.value:
+			raise ROIError(imSet.mode, 'Format7 mode is not supported by the camera. Mode ')
+		if not info.pixelFormatBitField & imSet.pixelFormat:
+			raise ROIError(hex(imSet.pixelFormat), 'Pixel format is not supported by the camera. Format ')
+		self.format7Info = info
+		valid = c_int()
+		packetInfo = fc2Format7PacketInfo()
+		handleError(FCDriver.fc2ValidateFormat7Settings(context, byref(imSet), byref(valid), byref(packetInfo)))
+		if not valid.value:
+			raise ROIError(self.roi, 'Format7 settings were rejected by the camera. ')
+		return packetInfo
+
+	def getPacketSize(self):
+		'''Returns the number of bytes per packet the camera sends images in.'''
+		imSet = fc2Format7ImageSettings()
+		packetSize = c_uint()
+		percentage = c_float()
+		handleError(FCDriver.fc2GetFormat7Configuration(self.context, byref(imSet), byref(packetSize), byref(percentage)))
+		return packetSize.value
+
+	def achievableFrameRate(self):
+		'''
+		Returns the highest frame rate (fps) the current settings allow. One
+		packet is sent per 125 us bus cycle, so the bus carries at most 8000
+		packets per second; the camera cannot expose faster than once per
+		exposure time either.
+		'''
+		roi = self.roi
+		(dtype, channels) = pixelFormatLayout[self.nativePixelFormat()]
+		frameBytes = roi.width * roi.height * channels * numpy.dtype(dtype).itemsize
+		packetsPerFrame = int(ceil(float(frameBytes) / self.packetSize))
+		return min(8000. / packetsPerFrame, 1000. / self.expTime_ms)
+
+	def reportFrameRate(self):
+		'''Prints the packet size and achievable frame rate when tuning bandwidth.'''
+		if self.tuneBandwidth:
+			print "Packet size %d bytes, up to %.1f frames per second." % (self.packetSize, self.achievableFrameRate())
 					
 # ----- Triggering Functions
 
 	def enableSoftwareTrigger(self):
 		'''Enable software triggering of camera.'''
+		self.setTriggerMode(7)
+	
+	def setTriggerMode(self, source):
+		'''Enables triggering of the camera from the given trigger source.'''
 		context = self.context
 		triggerMode = fc2TriggerMode()
 		triggerMode.onOff = True
 		triggerMode.mode = 0;
 		triggerMode.parameter = 0;
-		triggerMode.source = 7;
+		triggerMode.source = source;
 		handleError(FCDriver.fc2SetTriggerMode(context, byref(triggerMode)))
+		self.triggerSource = source
 	
-	def fireSoftwareTrigger(self):
+	def fireSoftwareTrigger(self, timeout = None, deadline = None):
 		'''
 		Triggers the camera when software triggering is enabled. Will wait
-		until trigger is available before triggering.
+		until trigger is available before triggering, see waitForTrigger.
+		Returns the time in s spent waiting.
 		'''
 		context = self.context
-		while self.getRegister(0x62C):
-			pass
-		handleError(FCDriver.fc2FireSoftwareTrigger(context))		
+		waited = self.waitForTrigger(timeout, deadline)
+		handleError(FCDriver.fc2FireSoftwareTrigger(context))
+		return waited
 	
-	def enableHardwareTrigger(self):
+	def enableHardwareTrigger(self, timeout = None):
 		'''Enable hardware triggering of camera.'''
+		self.setTriggerMode(0)
+		self.waitForTrigger(timeout, mask = 0x001)
+
+	def waitForTrigger(self, timeout = None, deadline = None, mask = 0xFFFFFFFF):
+		'''
+		Waits until the camera is ready to be triggered. The software trigger
+		register is polled with an interval starting at triggerPollInterval
+		and doubling up to triggerPollMax, so the wait does not keep a core
+		and the bus busy. The timer resolution is raised while waiting, see
+		raiseTimerResolution. Raises triggerError once timeout seconds have
+		passed (triggerTimeout by default) or once timer() passes deadline.
+		The time waited in s is returned and recorded in triggerWaits.
+		'''
+		if timeout is None:
+			timeout = self.triggerTimeout
+		start = timer()
+		if timeout is not None and (deadline is None or start + timeout < deadline):
+			deadline = start + timeout
+		interval = self.triggerPollInterval
+		restore = None
+		try:
+			while self.getRegister(fc2Register['SoftwareTrigger']) & mask:
+				if restore is None:
+					restore = raiseTimerResolution()
+				now = timer()
+				if deadline is None:
+					time.sleep(interval)
+				elif now < deadline:
+					time.sleep(min(interval, deadline - now))
+				else:
+					raise triggerError(now - start)
+				interval = min(2 * interval, self.triggerPollMax)
+		finally:
+			if restore is not None:
+				restore()
+		waited = timer() - start
+		self.triggerWaits.append(waited)
+		return waited
+
+	def scheduleTriggers(self, times = None, period = None, count = None, delay = 0.01, spin = 0.002, wait = True):
+		'''
+		Fires software triggers at the given times (s), or count triggers
+		period s apart, from a dedicated high priority thread. Times are
+		relative to the first trigger, which fires delay s after the call.
+		Each trigger waits for the camera to be ready, sleeps until spin s
+		before its time and then spins on the clock, so it fires on time
+		unless the camera is still busy. With a fixed period, the frames of
+		the current run are checked against it instead of expectedPeriod_ms,
+		see runPeriod.
+
+		Returns a TriggerSchedule holding the requested and actual fire
+		times. If wait is False it returns as soon as the thread is started.
+		'''
+		if times is None:
+			if period is None or count is None:
+				raise ValueError('Either times or period and count must be given.')
+			times = period * numpy.arange(count)
+			self.schedulePeriod_ms = 1000. * period
+		schedule = TriggerSchedule(self, times, timer() + delay, spin)
+		schedule.thread.start()
+		if wait:
+			schedule.wait()
+		return schedule
+
+# ----- Streaming Functions
+
+	def startStreaming(self, numOfImages = None, queueSize = 4, numBuffers = 4, keepImages = True):
+		'''
+		Readies camera to capture images when triggered and starts a
+		background thread which retrieves frames as they arrive. Frames are
+		handed to the consumer through a queue holding at most queueSize
+		frames, see nextImage and streamImages.
+
+		If numOfImages is given, frames are retrieved into the buffers set up
+		by setDataBuffers and are converted and timestamped by stop() as
+		usual. If numOfImages is None frames are retrieved indefinitely into
+		a small ring of images, so each frame is only valid until the
+		consumer asks for the next one.
+		
+		If keepImages is False frames are only passed to the attached stages
+		(see attachStage) and are neither queued nor kept for saving.
+		Frames are retrieved as soon as they arrive, so if the images of the
+		previous run are still being saved the other set of data buffers is
+		used, see swapDataBuffers.
+		'''
+		if numOfImages is None or not keepImages:
+			images = self.bufferPool.acquire('ring', queueSize + 2)
+		else:
+			if self.savesPending(self.bufferSet):
+				self.swapDataBuffers(numOfImages)
+			images = self.rawImageData
+			if len(images) < numOfImages:
+				raise ValueError('Data buffers hold %d images, %d requested. Call setDataBuffers first.' % (len(images), numOfImages))
+		self.setConfig(numBuffers - 1)
+		self.reportFrameRate()
+		handleError(FCDriver.fc2StartCapture(self.context))
+		self.capturing = True
+		self.clearBuffer()
+		self.triggerWaits = []
+		self.schedulePeriod_ms = None
+		self.streaming = True
+		self.streamCount = numOfImages
+		self.streamKeep = keepImages
+		self.streamQueue = Queue(queueSize)
+		self.streamError = None
+		self.streamStopped = False
+		self.streamRetrieved = 0
+		self.lastFrameTime = timer()
+		self.streamThread = Thread(target = self.retrievalLoop, args = (images, numOfImages))
+		self.streamThread.daemon = True
+		self.beginStages(numOfImages)
+		self.streamThread.start()
+
+	def retrievalLoop(self, images, numOfImages):
+		'''
+		Body of the retrieval thread. Retrieves frames from the camera as
+		they arrive and places (index, image) pairs on the stream queue,
+		followed by None once the run is over.
+		'''
 		context = self.context
-		triggerMode = fc2TriggerMode()
-		triggerMode.onOff = True
-		triggerMode.mode = 0;
-		triggerMode.parameter = 0;
-		triggerMode.source = 0;
-		handleError(FCDriver.fc2SetTriggerMode(context, byref(triggerMode)))
-		while (self.getRegister(0x62C) & 0x001):
-			pass		
+		queue = self.streamQueue
+		stages = self.stages
+		keep = self.streamKeep
+		words = self.frameWords = array('I')
+		latencies = self.retrievalLatencies = array('d')
+		i = 0
+		try:
+			waitStart = timer()
+			while not self.streamStopped and (numOfImages is None or i < numOfImages):
+				im = images[i % len(images)]
+				e = FCDriver.fc2RetrieveBuffer(context, byref(im))
+				if e == 18:	# Timeout, no frame has arrived yet.
+					continue
+				handleError(e)
+				latencies.append(timer() - waitStart)
+				d = im.pData
+				words.append((d[0] << 24) | (d[1] << 16) | (d[2] << 8) | d[3])
+				if stages:
+					frame = imageView(im)
+					for stage in stages:
+						stage.process(i, frame)
+				if keep:
+					queue.put((i, im))
+				i += 1
+				self.streamRetrieved = i
+				waitStart = self.lastFrameTime = timer()
+		except Exception, err:
+			self.streamError = err
+		queue.put(None)
+
+	def nextImage(self, timeout = None):
+		'''
+		Returns the next (index, image) pair retrieved by the streaming
+		thread, or None once the run is over. Blocks until a frame arrives.
+		'''
+		item = self.streamQueue.get(True, timeout)
+		if item is None:
+			self.streamQueue.put(None)
+			if self.streamError is not None:
+				raise self.streamError
+		return item
+
+	def streamImages(self):
+		'''Generator over the (index, image) pairs retrieved while streaming.'''
+		while True:
+			item = self.nextImage()
+			if item is None:
+				return
+			yield item
+
+	def stopStreaming(self):
+		'''
+		Stops the retrieval thread. If a fixed number of images was requested
+		the call waits until all of them have been retrieved, then converts
+		them and extracts their timestamps. If no frame arrives for
+		streamTimeout s, for example because a trigger was lost, the run is
+		ended with the images retrieved so far and the shortfall is printed.
+		'''
+		if self.streamCount is None:
+			self.streamStopped = True
+		timeout = self.streamTimeout
+		called = timer()
+		queue = self.streamQueue
+		while self.streamThread.isAlive():
+			if timeout is not None and timer() - max(called, self.lastFrameTime) > timeout:
+				self.streamStopped = True
+			# Keep the queue drained so the retrieval thread can finish.
+			if self.streamCount is None or queue.full():
+				try:
+					queue.get_nowait()
+				except Empty:
+					pass
+			self.streamThread.join(0.01)
+		# Consumers still waiting for frames must see the end of the run.
+		try:
+			queue.put_nowait(None)
+		except Full:
+			pass
+		self.streaming = False
+		if self.streamError is not None:
+			raise self.streamError
+		if self.streamCount is not None and self.streamKeep:
+			retrieved = self.streamRetrieved
+			if retrieved < self.streamCount:
+				print "!!!!! Only %d of %d images retrieved." % (retrieved, self.streamCount)
+			raw = self.rawImageData
+			if len(raw) > retrieved:
+				# Images past the last one retrieved hold no frame of this run.
+				self.rawImageData = raw[:retrieved]
+				if self.conImageData is raw:
+					self.conImageData = self.rawImageData
+				else:
+					self.conImageData = self.conImageData[:retrieved]
+			self.convertImages()
+			self.extractTimestamps()
+
+# ----- Processing Stages
+
+	def attachStage(self, stage):
+		'''
+		Attaches a processing stage to the retrieval path, for example a
+		PointGreyReduction.ReductionStage. Stages provide begin(PGC,
+		numOfImages), called when a run starts (numOfImages is None for open
+		ended runs), process(index, frame), called with a numpy view of every
+		raw frame as soon as it is retrieved, and end(), called by stop().
+		While streaming, process is called on the retrieval thread.
+		'''
+		self.stages.append(stage)
+	
+	def detachStage(self, stage):
+		'''Removes a processing stage from the retrieval path.'''
+		self.stages.remove(stage)
+	
+	def beginStages(self, numOfImages):
+		'''Tells all attached stages that a run is starting.'''
+		for stage in self.stages:
+			stage.begin(self, numOfImages)
 
 # ----- Timestamp Functions
 	
@@ -379,64 +1279,132 @@ class PointGreyController(object):
 	
 	def parseTimestamp(self, im):
 		'''Parses the timestamp encoded in an image.'''
-		def binarify(n, d):
-			'''
-			Outputs a string representing the binary representation of n with d digits,
-			adding padding zeros on the left.
-			'''
-			s = binary_repr(n)
-			while len(s) < d:
-				s = '0' + s
-			return s
-		
-		data = im.pData
-		byteString = data[0:4]
-		byteArray = map(ord, byteString)
-		acc = ''
-		for b in byteArray:
-			acc += binarify(b, 8)
-		try:
-			secondCount = int(acc[0:7], 2)
-			cycleCount = int(acc[7:20], 2)
-			cycleOffset = int(acc[20:], 2)
-		except ValueError:
-			print "Timestamp failure occurred in PointGreyController."
-			return -1
-		timestamp = Timestamp(secondCount, cycleCount, cycleOffset)
-		return timestamp.decodeTime()
+		return decodeTimestamps(timestampWords([im]))[3][0]
 			
 	def extractTimestamps(self):
 		'''
 		Extracts all of the timestamps from the images collected and stores
-		them in the timestamps array.
+		them in the timestamps array, in ms since the first image. The raw
+		timestamp words are kept in timestampWords.
 		'''
-		timestamps = self.timestamps
-		for i in range(len(timestamps)):
-			im = self.rawImageData[i]
-			ts = self.parseTimestamp(im)
-			timestamps[i] = ts
-		t0 = timestamps[0]
-		for i in range(len(timestamps)):
-			timestamps[i] = (timestamps[i] - t0) * 1000
+		words = timestampWords(self.rawImageData)
+		self.timestampWords = self.frameWords = words
+		if len(words) == 0:
+			self.timestamps = numpy.zeros(0)
+			return
+		times = decodeTimestamps(words)[3]
+		self.timestamps = (times - times[0]) * 1000
+	
+	def runPeriod(self):
+		'''
+		Trigger period (ms) the frames of the current run are checked against,
+		that of scheduleTriggers if called in this run, else expectedPeriod_ms.
+		'''
+		if self.schedulePeriod_ms is not None:
+			return self.schedulePeriod_ms
+		return self.expectedPeriod_ms
+	
+	def checkRun(self, expectedPeriod_ms = None, tolerance = None):
+		'''
+		Checks the embedded timestamps of the frames retrieved in the last
+		run for dropped, duplicated, out of order and mistimed frames (see
+		checkFrames), stores the FrameReport in frameReport and prints a
+		warning if any frame was flagged. The period and tolerance default
+		to runPeriod() and frameTolerance.
+		'''
+		if expectedPeriod_ms is None:
+			expectedPeriod_ms = self.runPeriod()
+		if tolerance is None:
+			tolerance = self.frameTolerance
+		report = checkFrames(numpy.asarray(self.frameWords, numpy.uint32), expectedPeriod_ms, tolerance)
+		self.frameReport = report
+		if not report.ok():
+			print "!!!!! Frame check failed: %s" % report
+		return report
 	
 # ----- Register Manipulation Functions	
 
-	def getRegister(self, addr):
+	def getRegister(self, addr, cached = False):
 		'''
-		Gets the value of the camera register at the given address.'''
+		Gets the value of the camera register at the given address. Limit
+		registers are only read from the camera once and are then served from
+		the register cache, as are all other registers if cached is set. Any
+		queued writes are flushed first.
+		'''
+		cache = self.registerCache
+		if addr in cache and (cached or addr in self.limitRegisters):
+			return cache[addr]
+		if self.pendingWrites:
+			self.flushRegisterWrites()
 		context = self.context
 		val = c_ulong()
 		handleError(FCDriver.fc2ReadRegister(context, addr, byref(val)))
+		if addr not in self.uncachedRegisters:
+			cache[addr] = val.value
 		return val.value
 	
-	def setRegister(self, addr, val):
+	def setRegister(self, addr, val, force = False):
 		'''
 		Sets the value of the camera register at the given address to the
-		given value.
+		given value. The write is skipped if the register is known to hold
+		the value already unless force is set, and is queued if
+		queueRegisterWrites is active. Writing the Initialize or Power
+		registers resets the camera and clears the register cache.
 		'''
+		val = val & 0xFFFFFFFF
+		if addr in self.uncachedRegisters:
+			if self.pendingWrites:
+				self.flushRegisterWrites()
+			self.writeRegister(addr, val)
+			if addr in (fc2Register['Initialize'], fc2Register['Power']):
+				self.registerCache.clear()
+			return
+		if not force and self.registerCache.get(addr) == val:
+			return
+		if self.pendingWrites is not None:
+			if addr not in self.pendingWrites:
+				self.pendingOrder.append(addr)
+			self.pendingWrites[addr] = val
+			return
+		self.writeRegister(addr, val)
+		self.registerCache[addr] = val
+	
+	def writeRegister(self, addr, val):
+		'''Writes a value to a camera register, bypassing the register cache.'''
 		context = self.context
 		val = c_uint(val)
 		handleError(FCDriver.fc2WriteRegister(context, addr, val))
+
+	def queueRegisterWrites(self):
+		'''
+		Queues register writes until flushRegisterWrites is called. Repeated
+		writes to one register are coalesced so only the last value is sent.
+		'''
+		if self.pendingWrites is None:
+			self.pendingWrites = {}
+			self.pendingOrder = []
+	
+	def flushRegisterWrites(self):
+		'''Sends all queued register writes to the camera, in queued order.'''
+		pending = self.pendingWrites
+		if pending is None:
+			return
+		self.pendingWrites = None
+		for addr in self.pendingOrder:
+			self.writeRegister(addr, pending[addr])
+			self.registerCache[addr] = pending[addr]
+		self.pendingOrder = []
+	
+	def invalidateRegisters(self, addrs = None):
+		'''
+		Removes the given registers, or all registers, from the register
+		cache so they are read from the camera again.
+		'''
+		if addrs is None:
+			self.registerCache.clear()
+		else:
+			for addr in addrs:
+				self.registerCache.pop(addr, None)
 		
 # ----- Leftover Functions
 
@@ -450,14 +1418,20 @@ class PointGreyController(object):
 		self.extractTimestamps()	
 
 	def setConfig(self, numOfImages):
-		'''Sets the camera configuration.'''
+		'''
+		Sets the camera configuration. The camera holds numOfImages + 1
+		buffers.
+		'''
 		context = self.context
 		config = fc2Config()
 		config.numBuffers = numOfImages + 1
 		config.numImageNotifications = 1
 		config.grabTimeout = 100
 		config.grabMode = fc2GrabMode['BUFFER_FRAMES']
-		config.isochBusSpeed = fc2BusSpeed['SPEED_UNKNOWN']
+		if self.tuneBandwidth:
+			config.isochBusSpeed = fc2BusSpeed['S_FASTEST']
+		else:
+			config.isochBusSpeed = fc2BusSpeed['SPEED_UNKNOWN']
 		config.asyncBusSpeed = fc2BusSpeed['ANY']
 		config.bandwidthAllocation = fc2BandwidthAllocation['ON']
 		handleError(FCDriver.fc2SetConfiguration(context, byref(config)))
@@ -468,7 +1442,7 @@ class PointGreyController(object):
 		runs are removed from camera.
 		''' 
 		context = self.context
-		im = self.initializeImage()
+		im = self.bufferPool.acquire('scratch', 1)[0]
 		while True:
 			e	= FCDriver.fc2RetrieveBuffer(context, byref(im))
 			if e == 18:	# Timeout
@@ -494,4 +1468,5 @@ if __name__ == '__main__':
 	PGC.saveRAWImages()
 	PGC.savePNGImages()
 	PGC.saveLog()
+	PGC.close()
 	del PGC
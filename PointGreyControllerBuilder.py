@@ -1,5 +1,28 @@
-from PointGreyController import ROI, PointGreyController
+from PointGreyController import ROI, PointGreyController, propertyError
+from PointGreyTypes import fc2PixelFormat
 from time import sleep
+import json
+
+# Values a profile may set, with the values used when they are left out.
+profileDefaults = dict(
+	gain = 0,
+	expTime_ms = 15,
+	useROI = False,
+	useROICenter = False,
+	ROI_left = 0,
+	ROI_top = 0,
+	ROI_width = 1288,
+	ROI_height = 964,
+	ROI_center = (644, 482),
+	boostFramerate = False,
+	)
+
+# Absolute ranges of the exposure time and gain of the Flea2. The range at a
+# given frame rate can be narrower, see CameraProfile.checkLimits.
+profileLimits = dict(
+	expTime_ms = (0.01, 66.63),
+	gain = (0., 24.),
+	)
 
 class PointGreyBuilder(object):
 	"""
@@ -11,15 +34,140 @@ class PointGreyBuilder(object):
 			setattr(self, k, v)
 			
 	def buildController(self):
+		# Framework dicts hold other settings too, which are ignored here.
+		return CameraProfile('builder', vars(self), strict = False).buildController()
+
+class CameraProfile(object):
+	"""
+	Settings of one named imaging mode, validated and converted once into
+	the aligned ROI and Format7 settings applied to the camera. Unknown
+	settings are rejected unless strict is False, exposure time and gain
+	outside profileLimits always.
+	"""
+	
+	def __init__(self, name, values, strict = True):
+		unknown = set(values) - set(profileDefaults)
+		if unknown and strict:
+			raise ValueError('Profile %s has unknown settings: %s.' % (name, ', '.join(sorted(unknown))))
+		v = dict(profileDefaults)
+		v.update(values)
+		for key in ('expTime_ms', 'gain'):
+			(low, high) = profileLimits[key]
+			if not low <= float(v[key]) <= high:
+				raise ValueError('Profile %s: %s must be between %g and %g.' % (name, key, low, high))
+		self.name = name
+		self.values = v
 		roi = ROI()
-		if (self.useROI or self.useROICenter):
-			if (self.useROICenter):
-				roi.setROICenter(self.ROI_center, self.ROI_width, self.ROI_height)	
+		if v['useROICenter']:
+			roi.setROICenter(tuple(v['ROI_center']), v['ROI_width'], v['ROI_height'])
+		elif v['useROI']:
+			roi.setROI(v['ROI_left'], v['ROI_top'], v['ROI_width'], v['ROI_height'])
+		self.roi = roi
+		self.boostFramerate = bool(v['boostFramerate'])
+		self.expTime_ms = float(v['expTime_ms'])
+		self.gain = float(v['gain'])
+		if self.boostFramerate:
+			pixelFormat = fc2PixelFormat['MONO8']
+		else:
+			pixelFormat = fc2PixelFormat['MONO16']
+		# As recorded by PointGreyController.setImageSettings and setRegister.
+		self.imageSettings = (roi.posLeft, roi.posTop, roi.width, roi.height, pixelFormat)
+	
+	def buildController(self, **kwargs):
+		'''Creates a controller with the settings of the profile.'''
+		return PointGreyController(expTime_ms = self.expTime_ms, gain = self.gain, roi = self.roi,
+			boostFramerate = self.boostFramerate, **kwargs)
+	
+	def checkLimits(self, PGC):
+		'''
+		Checks the exposure time and gain against the current limits of the
+		camera of a connected controller, raising a propertyError.
+		'''
+		(min, max) = PGC.getExposureLimits()
+		if not min < self.expTime_ms < max:
+			raise propertyError('Exposure time', self.expTime_ms, min, max, 'ms')
+		(min, max) = PGC.getGainLimits()
+		if not min < self.gain < max:
+			raise propertyError('Gain', self.gain, min, max, 'db')
+	
+	def isApplied(self, PGC):
+		'''
+		Whether a connected controller already runs with the settings of the
+		profile. The exposure time and gain are compared to the values last
+		requested from the controller, as the camera rounds them.
+		'''
+		return (PGC.connected and PGC.imageSettings == self.imageSettings
+			and PGC.requestedSettings == (self.expTime_ms, self.gain))
+	
+	def apply(self, PGC):
+		'''
+		Switches a controller to the profile between runs. Nothing is sent to
+		the camera if it already runs with these settings, otherwise only the
+		settings which differ are written (see PointGreyController.reconfigure)
+		and the exposure time and gain are checked against the camera limits.
+		'''
+		if self.isApplied(PGC):
+			return
+		PGC.reconfigure(self.roi, self.boostFramerate, self.expTime_ms, self.gain)
+
+class PointGreyProfiles(object):
+	"""
+	Named configuration profiles. Each profile is validated and precomputed
+	into a CameraProfile the first time it is used and cached after that.
+	"""
+	
+	def __init__(self, profiles = None):
+		self.values = dict(profiles or {})
+		self.cache = {}
+	
+	def __getitem__(self, name):
+		profile = self.cache.get(name)
+		if profile is None:
+			profile = self.cache[name] = CameraProfile(name, self.values[name])
+		return profile
+	
+	def names(self):
+		return sorted(self.values)
+	
+	def add(self, name, values):
+		'''Adds or replaces a profile.'''
+		self.values[name] = values
+		self.cache.pop(name, None)
+	
+	def validate(self, PGC = None):
+		'''
+		Validates and precomputes every profile, raising on the first invalid
+		one. If a connected controller is given the profiles are also checked
+		against the limits of its camera.
+		'''
+		for name in self.values:
+			if PGC is not None:
+				self[name].checkLimits(PGC)
 			else:
-				roi.setROI(self.ROI_left, self.ROI_top, self.ROI_width, self.ROI_height)
-		PGC = PointGreyController(expTime_ms = self.expTime_ms, gain = self.gain, roi = roi, boostFramerate = self.boostFramerate)								
-		return PGC
-		
+				self[name]
+	
+	def buildController(self, name, **kwargs):
+		'''Creates a controller with the settings of the named profile.'''
+		return self[name].buildController(**kwargs)
+	
+	def apply(self, PGC, name):
+		'''Switches a controller to the named profile, see CameraProfile.apply.'''
+		self[name].apply(PGC)
+
+def loadProfiles(fpath, PGC = None):
+	'''
+	Loads profiles from a JSON file holding an object which maps profile
+	names to the values given to a PointGreyBuilder, and validates them,
+	see PointGreyProfiles.validate.
+	'''
+	infile = open(fpath)
+	try:
+		profiles = PointGreyProfiles(json.load(infile))
+	finally:
+		infile.close()
+	profiles.validate(PGC)
+	return profiles
+	
 if __name__ == "__main__":
 	pointgrey_values = dict(
 							gain = 0,
@@ -48,5 +196,6 @@ if __name__ == "__main__":
 	PGC.stop()
 	PGC.saveLog()	
 	PGC.savePNGImages()
+	PGC.close()
 	del PGC
 	
\ No newline at end of file
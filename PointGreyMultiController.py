@@ -0,0 +1,157 @@
+'''
+Controller for several Point Grey cameras imaging at once. Each camera is
+driven by its own PointGreyController, and so its own FlyCapture2 context,
+and the slow per-camera steps run on one worker thread per camera.
+'''
+
+from PointGreyController import PointGreyController, ROI, getNumOfCameras
+from threading import Thread
+import os
+
+def cameraPath(fpath, prefix):
+	'''Adds a camera prefix to the file name of a path, keeping its directory.'''
+	(head, tail) = os.path.split(fpath)
+	return os.path.join(head, prefix + tail)
+
+class PointGreyMultiController(object):
+	"""
+	Manages a PointGreyController for every selected camera. Settings given
+	to the constructor are shared by all cameras, cameraSettings maps a camera
+	index to a dict overriding any of expTime_ms, gain, roi and boostFramerate
+	for that camera.
+	"""
+	
+	def __init__(self, numOfImages = 5, expTime_ms = 15, gain = 0, roi = None, boostFramerate = False, cameraIndices = None, cameraSettings = None):
+		if cameraIndices is None:
+			cameraIndices = range(getNumOfCameras())
+		if roi is None:
+			roi = ROI()
+		if cameraSettings is None:
+			cameraSettings = {}
+		self.numOfImages = numOfImages
+		self.cameraIndices = list(cameraIndices)
+		self.settings = {}
+		for index in self.cameraIndices:
+			settings = dict(numOfImages = numOfImages, expTime_ms = expTime_ms, gain = gain, roi = roi, boostFramerate = boostFramerate, cameraIndex = index)
+			settings.update(cameraSettings.get(index, {}))
+			self.settings[index] = settings
+		
+		self.controllers = {}
+		def connect(index):
+			self.controllers[index] = PointGreyController(**self.settings[index])
+		self.runParallel(connect)
+		
+	def __getitem__(self, index):
+		return self.controllers[index]
+	
+	def runParallel(self, func):
+		'''
+		Calls func(index) for every camera, each on its own thread, and waits
+		for all of them. The first error raised by any camera is re-raised.
+		'''
+		errors = []
+		def work(index):
+			try:
+				func(index)
+			except Exception, err:
+				errors.append(err)
+		threads = [Thread(target = work, args = (index,)) for index in self.cameraIndices]
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+		if errors:
+			raise errors[0]
+	
+	def forEach(self, name, *args, **kwargs):
+		'''Calls the named controller method on every camera in parallel.'''
+		self.runParallel(lambda index: getattr(self.controllers[index], name)(*args, **kwargs))
+		
+	def enableSoftwareTrigger(self):
+		'''Enable software triggering of all cameras.'''
+		for index in self.cameraIndices:
+			self.controllers[index].enableSoftwareTrigger()
+			
+	def enableHardwareTrigger(self):
+		'''Enable hardware triggering of all cameras.'''
+		self.forEach('enableHardwareTrigger')
+	
+	def fireSoftwareTrigger(self):
+		'''
+		Triggers all cameras. The cameras are triggered one after another
+		from this thread to keep the skew between them small.
+		'''
+		for index in self.cameraIndices:
+			self.controllers[index].waitForTrigger()
+		for index in self.cameraIndices:
+			self.controllers[index].fireSoftwareTrigger()
+	
+	def setDataBuffers(self, numOfImages):
+		'''Sets up the data buffers of every camera.'''
+		self.numOfImages = numOfImages
+		for index in self.cameraIndices:
+			self.controllers[index].numOfImages = numOfImages
+			self.controllers[index].setDataBuffers(numOfImages)
+	
+	def reconfigure(self, roi = None, boostFramerate = None, expTime_ms = None, gain = None):
+		'''
+		Changes the settings of every camera between runs, see
+		PointGreyController.reconfigure.
+		'''
+		self.forEach('reconfigure', roi, boostFramerate, expTime_ms, gain)
+	
+	def start(self):
+		'''Readies all cameras to capture images when triggered.'''
+		self.forEach('start')
+		
+	def stop(self):
+		'''
+		Stops all cameras. Retrieval and conversion of each camera's images
+		runs on its own thread.
+		'''
+		self.forEach('stop')
+	
+	def close(self):
+		'''Disconnects from all cameras and frees their images.'''
+		self.forEach('close')
+	
+	def __enter__(self):
+		return self
+	
+	def __exit__(self, excType, excValue, traceback):
+		self.close()
+	
+# ----- Save Functions
+
+	def saveRAWImages(self, fNameFormat = 'rawImage_%03d.raw', camFormat = 'cam%d_'):
+		'''Saves the images of every camera in raw format.'''
+		self.runParallel(lambda index: self.controllers[index].saveRAWImages(cameraPath(fNameFormat, camFormat % index)))
+		
+	def savePNGImages(self, fNameFormat = 'image_%03d.png', camFormat = 'cam%d_'):
+		'''Saves the images of every camera in png format.'''
+		self.runParallel(lambda index: self.controllers[index].savePNGImages(cameraPath(fNameFormat, camFormat % index)))
+	
+	def saveLog(self, fpath = 'log.pgl', camFormat = 'cam%d_'):
+		'''Appends the run of every camera to its run log.'''
+		for index in self.cameraIndices:
+			self.controllers[index].saveLog(cameraPath(fpath, camFormat % index))
+
+if __name__ == '__main__':
+	# Usage Example
+	numOfImages = 2
+	roi = ROI()
+	roi.setROI(100, 100, 600, 200)
+	PGMC = PointGreyMultiController(numOfImages, 0.5, 0, roi, cameraSettings = {1 : dict(gain = 5)})
+	PGMC.enableSoftwareTrigger()
+	PGMC.setDataBuffers(numOfImages)
+	PGMC.start()
+	count = 0
+	while count < numOfImages:
+		print "Fire Trigger: ", str(count + 1)
+		PGMC.fireSoftwareTrigger()
+		count += 1 
+	PGMC.stop()
+	PGMC.savePNGImages()
+	PGMC.saveLog()
+	PGMC.close()
+	del PGMC
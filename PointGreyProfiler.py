@@ -0,0 +1,166 @@
+'''
+Instrumentation of the FlyCapture2 driver calls made by the controller.
+
+enableProfiling() wraps the driver in an InstrumentedDriver, which records
+for every driver function the number of calls, the number of calls which
+returned an error and a histogram of call latencies. Register reads and
+writes are also broken down by register address, so for example the polls
+of the software trigger register show up as "fc2ReadRegister 0x62C". The
+calls can also be written to a trace file in the Chrome trace event format
+(viewable in chrome://tracing).
+
+	stats = enableProfiling('trace.json')
+	... run the controller ...
+	disableProfiling()
+	print stats.report()
+'''
+
+import PointGreyController as controllerModule
+from threading import Lock, current_thread
+from timeit import default_timer as timer
+import json
+import math
+import os
+
+# Upper edges (us) of the latency histogram buckets, powers of two up to ~17 s.
+BUCKETS = [2 ** i for i in range(25)]
+
+class CallStats(object):
+	"""Call count, error count and latency histogram of one function."""
+
+	def __init__(self):
+		self.count = 0
+		self.errors = 0
+		self.total = 0.
+		self.min = None
+		self.max = 0.
+		self.histogram = [0] * (len(BUCKETS) + 1)
+
+	def record(self, duration, error):
+		'''Records one call taking duration seconds.'''
+		self.count += 1
+		if error:
+			self.errors += 1
+		self.total += duration
+		if self.min is None or duration < self.min:
+			self.min = duration
+		if duration > self.max:
+			self.max = duration
+		us = duration * 1e6
+		if us < 1:
+			bucket = 0
+		else:
+			bucket = min(int(math.log(us, 2)) + 1, len(BUCKETS))
+		self.histogram[bucket] += 1
+
+	def mean(self):
+		'''Mean latency in seconds.'''
+		return self.count and self.total / self.count
+
+	def asDict(self):
+		return dict(count = self.count, errors = self.errors, total_s = self.total,
+			mean_s = self.mean(), min_s = self.min, max_s = self.max,
+			histogram_us = dict(('<%d' % edge, n) for (edge, n) in zip(BUCKETS, self.histogram) if n))
+
+class DriverStats(object):
+	"""Statistics of all instrumented driver calls, by function name."""
+
+	def __init__(self):
+		self.lock = Lock()
+		self.calls = {}
+
+	def record(self, name, duration, error):
+		with self.lock:
+			stats = self.calls.get(name)
+			if stats is None:
+				stats = self.calls[name] = CallStats()
+			stats.record(duration, error)
+
+	def reset(self):
+		with self.lock:
+			self.calls = {}
+
+	def asDict(self):
+		'''Returns the statistics as a dict, e.g. for saving as JSON.'''
+		with self.lock:
+			return dict((name, stats.asDict()) for (name, stats) in self.calls.items())
+
+	def report(self):
+		'''Returns the statistics as a table, sorted by total time.'''
+		lines = ['%-32s %8s %6s %10s %10s %10s %10s' % ('Function', 'Calls', 'Errors', 'Total ms', 'Mean us', 'Min us', 'Max us')]
+		with self.lock:
+			calls = sorted(self.calls.items(), key = lambda item: -item[1].total)
+			for (name, s) in calls:
+				lines.append('%-32s %8d %6d %10.3f %10.1f %10.1f %10.1f' % (name, s.count, s.errors,
+					1e3 * s.total, 1e6 * s.mean(), 1e6 * s.min, 1e6 * s.max))
+		return '\n'.join(lines)
+
+class InstrumentedDriver(object):
+	"""Wraps a driver, timing every function called through it."""
+
+	def __init__(self, driver, stats = None, traceFile = None):
+		self.driver = driver
+		if stats is None:
+			stats = DriverStats()
+		self.stats = stats
+		self.trace = None
+		self.traceLock = Lock()
+		self.epoch = timer()
+		if traceFile is not None:
+			self.trace = open(traceFile, 'w')
+			self.trace.write('[\n')
+
+	def __getattr__(self, name):
+		func = getattr(self.driver, name)
+		if not name.startswith('fc2'):
+			return func
+		stats = self.stats
+		registerCall = name in ('fc2ReadRegister', 'fc2WriteRegister')
+		def call(*args):
+			start = timer()
+			error = func(*args)
+			duration = timer() - start
+			stats.record(name, duration, error)
+			if registerCall:
+				stats.record('%s 0x%X' % (name, args[1]), duration, error)
+			if self.trace is not None:
+				self.writeEvent(name, start, duration, error)
+			return error
+		# Cache the wrapper so __getattr__ only runs once per function.
+		setattr(self, name, call)
+		return call
+
+	def writeEvent(self, name, start, duration, error):
+		'''Writes one call to the trace file.'''
+		event = dict(name = name, ph = 'X', pid = os.getpid(), tid = current_thread().ident,
+			ts = 1e6 * (start - self.epoch), dur = 1e6 * duration, args = dict(error = error))
+		with self.traceLock:
+			if self.trace is not None:
+				self.trace.write(json.dumps(event) + ',\n')
+
+	def close(self):
+		'''Closes the trace file.'''
+		with self.traceLock:
+			if self.trace is not None:
+				self.trace.write('{}]\n')
+				self.trace.close()
+				self.trace = None
+
+def enableProfiling(traceFile = None):
+	'''
+	Instruments the driver used by all controllers. Returns the DriverStats
+	the calls are recorded in.
+	'''
+	driver = controllerModule.FCDriver
+	if isinstance(driver, InstrumentedDriver):
+		return driver.stats
+	driver = InstrumentedDriver(driver, traceFile = traceFile)
+	controllerModule.setDriver(driver)
+	return driver.stats
+
+def disableProfiling():
+	'''Restores the uninstrumented driver and closes any trace file.'''
+	driver = controllerModule.FCDriver
+	if isinstance(driver, InstrumentedDriver):
+		driver.close()
+		controllerModule.setDriver(driver.driver)
@@ -0,0 +1,135 @@
+'''
+Recorder streaming frames from a PointGreyController into a preallocated,
+memory mapped file, so long acquisitions are not limited by the number of
+fc2Image buffers that fit in memory.
+
+Frames are written to a .npy file of shape (numOfFrames, height, width) in
+the native pixel format of the camera. A second .npy file next to it (the
+same name ending in _index.npy) holds, for every slot, the number of the
+frame stored in it (-1 while empty or being written) and its embedded
+timestamp word. Both files can be opened with openRecording by another
+process while recording is still in progress. The arrays it returns are
+live, so a slot can be overwritten while it is read; readFrame copies a
+frame and reads it again if the slot changed in the meantime.
+
+In the fixed layout recording stops once numOfFrames frames are stored. In
+the circular layout frame i is stored in slot i % numOfFrames, so the file
+always holds the most recent numOfFrames frames.
+'''
+
+from PointGreyController import imageView, timestampWords, decodeTimestamps
+from threading import Thread
+from numpy.lib.format import open_memmap
+import os
+import numpy
+
+indexType = numpy.dtype([('frame', '<i8'), ('timestampWord', '<u4')])
+
+def indexPath(fpath):
+	'''Returns the path of the index file belonging to a recording.'''
+	return os.path.splitext(fpath)[0] + '_index.npy'
+
+class RingRecorder(object):
+	"""Records frames streamed by a controller into a memory mapped file."""
+
+	def __init__(self, PGC, fpath, numOfFrames, circular = False):
+		self.PGC = PGC
+		self.fpath = fpath
+		self.numOfFrames = numOfFrames
+		self.circular = circular
+		if PGC.boostFramerate:
+			dtype = numpy.uint8
+		else:
+			dtype = numpy.uint16
+		shape = (numOfFrames, PGC.roi.height, PGC.roi.width)
+		self.frames = open_memmap(fpath, 'w+', dtype, shape)
+		self.index = open_memmap(indexPath(fpath), 'w+', indexType, (numOfFrames,))
+		self.index['frame'] = -1
+		self.index.flush()
+		self.framesWritten = 0
+		self.error = None
+		self.thread = None
+
+	def start(self, queueSize = 16, numBuffers = 8):
+		'''Readies the camera and starts recording the frames it captures.'''
+		self.PGC.startStreaming(None, queueSize, numBuffers)
+		self.thread = Thread(target = self.record)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def record(self):
+		'''Body of the recording thread.'''
+		frames = self.frames
+		index = self.index
+		numOfFrames = self.numOfFrames
+		try:
+			for (i, im) in self.PGC.streamImages():
+				slot = i % numOfFrames
+				# Mark the slot empty while it is overwritten, so readFrame
+				# notices a frame changing under it.
+				index['frame'][slot] = -1
+				frames[slot] = imageView(im)
+				index['timestampWord'][slot] = timestampWords([im])[0]
+				index['frame'][slot] = i
+				self.framesWritten = i + 1
+				if self.isFull():
+					break
+		except Exception, err:
+			self.error = err
+
+	def isFull(self):
+		'''Whether a fixed length recording has stored all of its frames.'''
+		return not self.circular and self.framesWritten >= self.numOfFrames
+
+	def wait(self, timeout = None):
+		'''Waits until a fixed length recording is full.'''
+		self.thread.join(timeout)
+
+	def stop(self):
+		'''Stops recording and the camera, and flushes the files to disk.'''
+		self.PGC.stop()
+		self.thread.join()
+		self.frames.flush()
+		self.index.flush()
+		if self.error is not None:
+			raise self.error
+
+def openRecording(fpath):
+	'''
+	Opens a recording read only. Returns the memory mapped frames and index
+	arrays along with the slots of the stored frames in acquisition order.
+	The arrays change as long as the recording goes on, see readFrame.
+	'''
+	frames = numpy.load(fpath, mmap_mode = 'r')
+	index = numpy.load(indexPath(fpath), mmap_mode = 'r')
+	numbers = numpy.array(index['frame'])
+	slots = numpy.flatnonzero(numbers >= 0)
+	slots = slots[numpy.argsort(numbers[slots])]
+	return frames, index, slots
+
+def readFrame(frames, index, slot):
+	'''
+	Copies a frame out of arrays returned by openRecording. Returns its
+	number, its timestamp word and the copy, or None if the slot is empty or
+	being written. The number is checked again after copying, and the copy
+	retried if the frame was replaced while it was copied.
+	'''
+	while True:
+		number = index['frame'][slot]
+		if number < 0:
+			return None
+		word = index['timestampWord'][slot]
+		frame = numpy.array(frames[slot])
+		if index['frame'][slot] == number:
+			return int(number), int(word), frame
+
+def recordingTimestamps(fpath):
+	'''
+	Returns the numbers of the frames stored in a recording, in acquisition
+	order, and their timestamps in ms since the first of them.
+	'''
+	frames, index, slots = openRecording(fpath)
+	times = decodeTimestamps(numpy.array(index['timestampWord'][slots]))[3]
+	if len(times):
+		times = (times - times[0]) * 1000
+	return numpy.array(index['frame'][slots]), times
@@ -0,0 +1,116 @@
+'''
+Per frame reduction of images as they are retrieved, for fast feedback
+without saving or reloading full frames.
+
+A ReductionStage holds a set of named reducers. Attached to a controller
+with PointGreyController.attachStage it runs every reducer on each frame as
+soon as the frame is retrieved and collects the results into one array per
+reducer, indexed by frame number. A reducer is any function taking a frame
+(a 2D numpy array) and returning a number or a fixed size array; the
+functions below build the common ones.
+
+	stage = ReductionStage(dict(
+		atoms = roiSum(400, 300, 200, 200),
+		spot = moments(),
+		))
+	PGC.attachStage(stage)
+	PGC.startStreaming(numOfImages, keepImages = False)
+	...
+	PGC.stop()
+	stage.results['atoms']
+'''
+
+import numpy
+
+# ----- Reducers ----- #
+
+def roiSum(left, top, width, height):
+	'''Sum of the pixel values in a rectangular region.'''
+	def reduce(frame):
+		return frame[top:top + height, left:left + width].sum(dtype = numpy.float64)
+	return reduce
+
+def rowProjection():
+	'''Sum of every row of the frame.'''
+	def reduce(frame):
+		return frame.sum(1, dtype = numpy.float64)
+	return reduce
+
+def columnProjection():
+	'''Sum of every column of the frame.'''
+	def reduce(frame):
+		return frame.sum(0, dtype = numpy.float64)
+	return reduce
+
+def moments():
+	'''
+	Total signal, centroid (x, y) and rms width (x, y) of the frame in
+	pixels, computed from its row and column projections.
+	'''
+	def reduce(frame):
+		cols = frame.sum(0, dtype = numpy.float64)
+		rows = frame.sum(1, dtype = numpy.float64)
+		total = cols.sum()
+		if total == 0:
+			return numpy.zeros(5)
+		x = numpy.arange(len(cols))
+		y = numpy.arange(len(rows))
+		cx = numpy.dot(x, cols) / total
+		cy = numpy.dot(y, rows) / total
+		sx = numpy.sqrt(max(numpy.dot((x - cx) ** 2, cols) / total, 0))
+		sy = numpy.sqrt(max(numpy.dot((y - cy) ** 2, rows) / total, 0))
+		return numpy.array([total, cx, cy, sx, sy])
+	return reduce
+
+def backgroundSubtracted(background, reducer):
+	'''
+	Applies reducer to the frame after subtracting a background frame. The
+	difference is computed into a preallocated buffer, so no memory is
+	allocated per frame.
+	'''
+	background = numpy.asarray(background, numpy.float32)
+	buf = numpy.empty(background.shape, numpy.float32)
+	def reduce(frame):
+		numpy.subtract(frame, background, buf)
+		return reducer(buf)
+	return reduce
+
+# ----- Reduction Stage ----- #
+
+class ReductionStage(object):
+	"""
+	Runs named reducers on every frame of a run and collects their results
+	in results, a dict of arrays whose first axis is the frame number.
+	"""
+
+	def __init__(self, reducers, capacity = 256):
+		self.reducers = reducers
+		self.capacity = capacity	# Initial length of results for open ended runs.
+		self.results = {}
+		self.count = 0
+
+	def begin(self, PGC, numOfImages):
+		'''Clears the results for a new run of numOfImages frames.'''
+		self.length = numOfImages or self.capacity
+		self.results = {}
+		self.count = 0
+
+	def process(self, index, frame):
+		'''Runs every reducer on the frame with the given number.'''
+		results = self.results
+		for (name, reducer) in self.reducers.items():
+			value = numpy.asarray(reducer(frame))
+			out = results.get(name)
+			if out is None:
+				out = results[name] = numpy.zeros((self.length,) + value.shape, value.dtype)
+			if index >= len(out):
+				grown = numpy.zeros((max(2 * len(out), index + 1),) + out.shape[1:], out.dtype)
+				grown[:len(out)] = out
+				out = results[name] = grown
+			out[index] = value
+		self.count = max(self.count, index + 1)
+
+	def end(self):
+		'''Trims the results to the number of frames processed.'''
+		for name in self.results:
+			self.results[name] = self.results[name][:self.count]
@@ -0,0 +1,189 @@
+'''
+Binary run log. Every run saved with appendRun (PointGreyController.saveLog)
+is appended to the log file as a header followed by one fixed size record
+per frame:
+
+	index			frame number in the run
+	timestampWord	embedded timestamp word as read from the image
+	seconds, count, offset	its decoded fields
+	time			time since the first frame of the run (ms)
+	latency			time retrieving the frame took (s), including waiting for it
+	status			frame check result, one of PointGreyController.FRAME_*
+
+The header holds the run number, the date and the controller settings as
+JSON. A sidecar index file (the log path ending in .idx) holds one entry per
+run with its number, date, file offset and number of frames, so a run can
+be found without scanning the log; rebuildIndex recreates it from the log.
+Records are read back with a single bulk read into a numpy record array.
+'''
+
+from PointGreyController import decodeTimestamps
+from PointGreyWriter import runMetadata
+import json
+import os
+import struct
+import time
+import numpy
+
+MAGIC = 'PGRL'
+VERSION = 1
+
+# Magic, version, run number, date (s since the epoch), number of frames and
+# length of the JSON settings which follow.
+headerFormat = '<4sHIdII'
+headerSize = struct.calcsize(headerFormat)
+
+recordType = numpy.dtype([
+	('index', '<u4'),
+	('timestampWord', '<u4'),
+	('seconds', 'u1'),
+	('count', '<u2'),
+	('offset', '<u2'),
+	('time', '<f8'),
+	('latency', '<f4'),
+	('status', 'u1'),
+	])
+
+indexType = numpy.dtype([
+	('run', '<u4'),
+	('date', '<f8'),
+	('position', '<u8'),	# File offset of the run header.
+	('numOfFrames', '<u4'),
+	])
+
+def indexPath(fpath):
+	'''Returns the path of the index file of a log.'''
+	return fpath + '.idx'
+
+def runRecords(PGC):
+	'''Returns the records of the frames of a controller's last run.'''
+	words = numpy.asarray(PGC.frameWords, numpy.uint32)
+	n = len(words)
+	records = numpy.zeros(n, recordType)
+	records['index'] = numpy.arange(n)
+	records['timestampWord'] = words
+	(seconds, count, offset, times) = decodeTimestamps(words)
+	records['seconds'] = seconds
+	records['count'] = count
+	records['offset'] = offset
+	if n:
+		records['time'] = (times - times[0]) * 1000
+	latencies = numpy.asarray(PGC.retrievalLatencies, numpy.float64)
+	if len(latencies) == n:
+		records['latency'] = latencies
+	report = PGC.frameReport
+	if report is not None and len(report.status) == n:
+		records['status'] = report.status
+	return records
+
+def appendRun(PGC, fpath):
+	'''
+	Appends the last run of a controller to the log at fpath. Returns the
+	number of the run in the log.
+	'''
+	settings = runMetadata(PGC)
+	settings['numOfImages'] = len(PGC.frameWords)
+	settings['expectedPeriod_ms'] = PGC.runPeriod()
+	settings['packetSize'] = PGC.packetSize
+	if PGC.frameReport is not None:
+		settings['droppedFrames'] = PGC.frameReport.dropped
+	return writeRun(fpath, settings, runRecords(PGC))
+
+def writeRun(fpath, settings, records):
+	'''Appends a run with the given settings and records to the log at fpath.'''
+	if os.path.exists(fpath) and not os.path.exists(indexPath(fpath)):
+		rebuildIndex(fpath)
+	run = len(readIndex(fpath))
+	date = time.time()
+	records = numpy.asarray(records, recordType)
+	encoded = json.dumps(settings)
+	outfile = open(fpath, 'ab')
+	try:
+		outfile.seek(0, os.SEEK_END)
+		position = outfile.tell()
+		outfile.write(struct.pack(headerFormat, MAGIC, VERSION, run, date, len(records), len(encoded)))
+		outfile.write(encoded)
+		outfile.write(records.tostring())
+	finally:
+		outfile.close()
+	entry = numpy.array([(run, date, position, len(records))], indexType)
+	indexfile = open(indexPath(fpath), 'ab')
+	try:
+		indexfile.write(entry.tostring())
+	finally:
+		indexfile.close()
+	return run
+
+def readIndex(fpath):
+	'''Returns the index of the log at fpath as a numpy record array.'''
+	path = indexPath(fpath)
+	if not os.path.exists(path):
+		return numpy.zeros(0, indexType)
+	return numpy.fromfile(path, indexType)
+
+def readHeader(infile):
+	'''Reads a run header and its settings from the current position of infile.'''
+	header = infile.read(headerSize)
+	if len(header) < headerSize:
+		return None
+	(magic, version, run, date, numOfFrames, length) = struct.unpack(headerFormat, header)
+	if magic != MAGIC:
+		raise IOError('Not a run log header at offset %d.' % (infile.tell() - headerSize))
+	if version != VERSION:
+		raise IOError('Unsupported run log version %d.' % version)
+	settings = json.loads(infile.read(length))
+	return run, date, numOfFrames, settings
+
+def readRun(fpath, run = -1):
+	'''
+	Reads one run from the log at fpath, by default the last one. Returns
+	its settings and records.
+	'''
+	entry = readIndex(fpath)[run]
+	infile = open(fpath, 'rb')
+	try:
+		infile.seek(int(entry['position']))
+		(number, date, numOfFrames, settings) = readHeader(infile)
+		records = numpy.fromfile(infile, recordType, numOfFrames)
+	finally:
+		infile.close()
+	settings['run'] = number
+	return settings, records
+
+def readLog(fpath):
+	'''
+	Reads every run of the log at fpath in one pass. Returns a list of
+	(settings, records) pairs in the order the runs were written.
+	'''
+	data = numpy.fromfile(fpath, numpy.uint8)
+	runs = []
+	position = 0
+	while position < len(data):
+		(magic, version, run, date, numOfFrames, length) = struct.unpack(headerFormat, data[position:position + headerSize].tostring())
+		if magic != MAGIC:
+			raise IOError('Not a run log header at offset %d.' % position)
+		position += headerSize
+		settings = json.loads(data[position:position + length].tostring())
+		settings['run'] = run
+		position += length
+		end = position + numOfFrames * recordType.itemsize
+		runs.append((settings, data[position:end].view(recordType)))
+		position = end
+	return runs
+
+def rebuildIndex(fpath):
+	'''Recreates the index file of the log at fpath by scanning its headers.'''
+	entries = []
+	infile = open(fpath, 'rb')
+	try:
+		while True:
+			position = infile.tell()
+			header = readHeader(infile)
+			if header is None:
+				break
+			(run, date, numOfFrames, settings) = header
+			entries.append((run, date, position, numOfFrames))
+			infile.seek(numOfFrames * recordType.itemsize, os.SEEK_CUR)
+	finally:
+		infile.close()
+	numpy.array(entries, indexType).tofile(indexPath(fpath))
@@ -0,0 +1,530 @@
+'''
+Simulated FlyCapture2 driver. Implements, in process, the FlyCapture2 C
+functions used by PointGreyController so the controller can be imported,
+exercised and profiled without the vendor library or a camera attached.
+
+The driver is selected by setting the PGC_DRIVER environment variable to
+"simulated" before PointGreyController is imported, or by passing a
+SimulatedDriver to PointGreyController.setDriver.
+
+Simulated cameras behave like a Flea2: frames are produced when triggered
+(or continuously when triggering is off) at no more than frameRate frames
+per second, or fewer if the Format7 packet size is too small to send them
+that fast, carry an embedded timestamp in their first four bytes when
+register 0x12F8 is set, and are dropped when the driver buffers are full.
+'''
+
+from PointGreyTypes import *
+from ctypes import *
+from struct import pack, unpack
+from threading import Lock
+from timeit import default_timer as timer
+import time
+import zlib
+import numpy
+
+# Error codes, indices into fc2ErrorCodeStrings.
+OK = 0
+FAILED = 1
+NOT_CONNECTED = 4
+INVALID_PARAMETER = 7
+NOT_FOUND = 12
+INVALID_PACKET_SIZE = 14
+NOT_SUPPORTED = 17
+TIMEOUT = 18
+ISOCH_ALREADY_STARTED = 31
+ISOCH_NOT_STARTED = 32
+CONVERSION_FAILED = 38
+
+SENSOR_WIDTH = 1288
+SENSOR_HEIGHT = 964
+
+# Format7 limits of the simulated camera. Packets of at most MAX_PACKET_SIZE
+# bytes are sent, one every 125 us bus cycle, as on a 1394b bus at S800.
+MAX_PACKET_SIZE = 8192
+PACKET_UNIT = 4
+OFFSET_STEP = 2
+WIDTH_STEP = 8
+HEIGHT_STEP = 2
+PIXEL_FORMATS = fc2PixelFormat['MONO8'] | fc2PixelFormat['MONO16'] | fc2PixelFormat['RAW8'] | fc2PixelFormat['RAW16']
+
+def deref(arg):
+	'''Returns the object behind a byref() argument.'''
+	return getattr(arg, '_obj', arg)
+
+def value(arg):
+	'''Returns the Python value of a ctypes argument.'''
+	return getattr(arg, 'value', arg)
+
+def floatWord(fl):
+	'''Returns the register word holding the floating point number fl.'''
+	return unpack('>I', pack('>f', fl))[0]
+
+def bytesPerPixel(pixelFormat):
+	'''Returns the number of bytes per pixel of a pixel format.'''
+	if pixelFormat in (fc2PixelFormat['MONO16'], fc2PixelFormat['RAW16']):
+		return 2
+	if pixelFormat in (fc2PixelFormat['BGR'], fc2PixelFormat['RGB8']):
+		return 3
+	if pixelFormat == fc2PixelFormat['BGRU']:
+		return 4
+	if pixelFormat == fc2PixelFormat['BGR16']:
+		return 6
+	return 1
+
+def validSettings(s):
+	'''Whether Format7 image settings are within the limits of the camera.'''
+	return (s.mode == 0 and s.width > 0 and s.height > 0
+		and s.offsetX + s.width <= SENSOR_WIDTH and s.offsetY + s.height <= SENSOR_HEIGHT
+		and not (s.offsetX % OFFSET_STEP or s.offsetY % OFFSET_STEP)
+		and not (s.width % WIDTH_STEP or s.height % HEIGHT_STEP)
+		and bool(s.pixelFormat & PIXEL_FORMATS))
+
+def encodeTimestamp(t):
+	'''Encodes a time in seconds the way the camera embeds it in an image.'''
+	seconds = int(t)
+	cycles = (t - seconds) * 8000.
+	count = int(cycles)
+	offset = min(int((cycles - count) * 3072.), 3071)
+	return ((seconds % 128) << 25) | (count << 12) | offset
+
+class SimulatedCamera(object):
+	"""State of one simulated camera."""
+
+	def __init__(self, index, frameRate):
+		self.index = index
+		self.frameRate = frameRate
+		self.lock = Lock()
+		self.epoch = timer()
+		self.reset()
+
+	def reset(self):
+		'''Returns the camera to its power on state.'''
+		self.registers = {
+			0x910 : floatWord(1e-5),		# Shutter minimum (s).
+			0x914 : floatWord(0.066),		# Shutter maximum (s).
+			0x918 : floatWord(0.01),		# Shutter (s).
+			0x920 : floatWord(-2.),			# Gain minimum (dB).
+			0x924 : floatWord(24.),			# Gain maximum (dB).
+			0x928 : floatWord(0.),			# Gain (dB).
+		}
+		self.settings = fc2Format7ImageSettings()
+		self.settings.width = SENSOR_WIDTH
+		self.settings.height = SENSOR_HEIGHT
+		self.settings.pixelFormat = fc2PixelFormat['MONO8']
+		self.packetSize = MAX_PACKET_SIZE / 2
+		self.config = fc2Config()
+		self.config.numBuffers = 10
+		self.config.grabTimeout = 100
+		self.config.grabMode = fc2GrabMode['BUFFER_FRAMES']
+		self.triggerMode = fc2TriggerMode()
+		self.capturing = False
+		self.frames = []	# Times at which pending frames are read out.
+		self.busyUntil = 0.
+		self.nextFreeRun = 0.
+		self.droppedFrames = 0
+		self.base = None
+
+	def exposure(self):
+		'''Exposure time in s.'''
+		return unpack('>f', pack('>I', self.registers[0x918]))[0]
+
+	def period(self):
+		'''
+		Shortest time in s between two frames, set by the exposure time, the
+		frame rate of the sensor and the packets needed to send a frame.
+		'''
+		s = self.settings
+		frameBytes = s.width * s.height * bytesPerPixel(s.pixelFormat)
+		packets = -(-frameBytes // self.packetSize)
+		return max(self.exposure(), 1. / self.frameRate, packets / 8000.)
+
+	def queueFrame(self, t):
+		'''Queues a frame read out at time t, dropping it if the buffers are full.'''
+		if len(self.frames) >= max(self.config.numBuffers, 1):
+			self.droppedFrames += 1
+		else:
+			self.frames.append(t)
+
+	def trigger(self):
+		'''Starts an exposure now if the camera is ready for one.'''
+		with self.lock:
+			now = timer()
+			if not self.capturing or now < self.busyUntil:
+				self.droppedFrames += 1
+				return
+			self.busyUntil = now + self.period()
+			self.queueFrame(self.busyUntil)
+
+	def freeRun(self, now):
+		'''Queues the frames produced since the last call when triggering is off.'''
+		if self.triggerMode.onOff or not self.capturing:
+			return
+		period = self.period()
+		while self.nextFreeRun <= now:
+			self.queueFrame(self.nextFreeRun)
+			self.nextFreeRun += period
+
+	def baseFrame(self):
+		'''
+		Returns the pixel data frames are copied from, a gaussian spot on a
+		dark background, for the current image settings.
+		'''
+		s = self.settings
+		key = (s.width, s.height, s.pixelFormat)
+		if self.base is None or self.base[0] != key:
+			y, x = numpy.mgrid[0:s.height, 0:s.width]
+			spot = numpy.exp(-((x - s.width / 2.) ** 2 + (y - s.height / 2.) ** 2) / (2 * (min(s.width, s.height) / 6.) ** 2))
+			if bytesPerPixel(s.pixelFormat) == 2:
+				data = (100 + 60000 * spot).astype(numpy.uint16)
+			else:
+				data = (10 + 230 * spot).astype(numpy.uint8)
+			self.base = (key, data.tostring())
+		return self.base[1]
+
+class SimulatedDriver(object):
+	"""
+	Drop-in replacement for the FlyCapture2_C library. Every function
+	returns a FlyCapture2 error code, as the C functions do.
+	"""
+
+	def __init__(self, numOfCameras = 1, frameRate = 30.):
+		self.cameras = [SimulatedCamera(i, frameRate) for i in range(numOfCameras)]
+		self.contexts = {}	# Context handle -> camera index, None if not connected.
+		self.nextContext = 1
+		self.buffers = {}	# Address of fc2Image -> buffer holding its data.
+
+	def camera(self, context):
+		'''Returns the camera connected to a context.'''
+		index = self.contexts.get(value(context))
+		if index is None:
+			return None
+		return self.cameras[index]
+
+	def fireHardwareTrigger(self, index = 0):
+		'''Simulates a pulse on the trigger input of a camera.'''
+		camera = self.cameras[index]
+		if camera.triggerMode.onOff and camera.triggerMode.source != 7:
+			camera.trigger()
+
+# ----- Context Functions
+
+	def fc2CreateContext(self, pContext):
+		context = self.nextContext
+		self.nextContext += 1
+		self.contexts[context] = None
+		deref(pContext).value = context
+		return OK
+
+	def fc2DestroyContext(self, context):
+		if value(context) not in self.contexts:
+			return INVALID_PARAMETER
+		del self.contexts[value(context)]
+		return OK
+
+	def fc2GetNumOfCameras(self, context, pNum):
+		deref(pNum).value = len(self.cameras)
+		return OK
+
+	def fc2GetCameraFromIndex(self, context, index, pGuid):
+		if not 0 <= index < len(self.cameras):
+			return NOT_FOUND
+		guid = deref(pGuid)
+		guid[0] = index + 1
+		return OK
+
+	def fc2Connect(self, context, pGuid):
+		index = deref(pGuid)[0] - 1
+		if value(context) not in self.contexts or not 0 <= index < len(self.cameras):
+			return NOT_FOUND
+		self.contexts[value(context)] = index
+		return OK
+
+# ----- Register Functions
+
+	def fc2ReadRegister(self, context, addr, pVal):
+		camera = self.camera(context)
+		if camera is None:
+			return NOT_CONNECTED
+		if addr == fc2Register['SoftwareTrigger']:
+			if timer() < camera.busyUntil:
+				val = 0x80000000
+			else:
+				val = 0
+		else:
+			val = camera.registers.get(addr, 0)
+		deref(pVal).value = val
+		return OK
+
+	def fc2WriteRegister(self, context, addr, val):
+		camera = self.camera(context)
+		if camera is None:
+			return NOT_CONNECTED
+		val = value(val)
+		if addr in (fc2Register['Initialize'], fc2Register['Power']) and val & 0x80000000:
+			if addr == fc2Register['Initialize']:
+				camera.reset()
+			return OK
+		camera.registers[addr] = val
+		return OK
+
+# ----- Configuration Functions
+
+	def fc2SetConfiguration(self, context, pConfig):
+		camera = self.camera(context)
+		if camera is None:
+			return NOT_CONNECTED
+		pointer(camera.config)[0] = deref(pConfig)
+		return OK
+
+	def fc2SetFormat7Configuration(self, context, pSettings, percentSpeed):
+		percent = min(max(value(percentSpeed), 0.), 100.)
+		packetSize = int(MAX_PACKET_SIZE * percent / 100.) // PACKET_UNIT * PACKET_UNIT
+		return self.fc2SetFormat7ConfigurationPacket(context, pSettings, max(packetSize, PACKET_UNIT))
+
+	def fc2SetFormat7ConfigurationPacket(self, context, pSettings, packetSize):
+		camera = self.camera(context)
+		if camera is None:
+			return NOT_CONNECTED
+		if camera.capturing:
+			return ISOCH_ALREADY_STARTED
+		s = deref(pSettings)
+		if not validSettings(s):
+			return INVALID_PARAMETER
+		packetSize = value(packetSize)
+		if not PACKET_UNIT <= packetSize <= MAX_PACKET_SIZE or packetSize % PACKET_UNIT:
+			return INVALID_PACKET_SIZE
+		pointer(camera.settings)[0] = s
+		camera.packetSize = packetSize
+		return OK
+
+	def fc2GetFormat7Configuration(self, context, pSettings, pPacketSize, pPercentage):
+		camera = self.camera(context)
+		if camera is None:
+			return NOT_CONNECTED
+		pointer(deref(pSettings))[0] = camera.settings
+		deref(pPacketSize).value = camera.packetSize
+		deref(pPercentage).value = 100. * camera.packetSize / MAX_PACKET_SIZE
+		return OK
+
+	def fc2GetFormat7Info(self, context, pInfo, pSupported):
+		camera = self.camera(context)
+		if camera is None:
+			return NOT_CONNECTED
+		info = deref(pInfo)
+		deref(pSupported).value = info.mode == 0
+		if info.mode == 0:
+			info.maxWidth = SENSOR_WIDTH
+			info.maxHeight = SENSOR_HEIGHT
+			info.offsetHStepSize = info.offsetVStepSize = OFFSET_STEP
+			info.imageHStepSize = WIDTH_STEP
+			info.imageVStepSize = HEIGHT_STEP
+			info.pixelFormatBitField = PIXEL_FORMATS
+			info.packetSize = camera.packetSize
+			info.minPacketSize = PACKET_UNIT
+			info.maxPacketSize = MAX_PACKET_SIZE
+			info.percentage = 100. * camera.packetSize / MAX_PACKET_SIZE
+		return OK
+
+	def fc2ValidateFormat7Settings(self, context, pSettings, pValid, pPacketInfo):
+		camera = self.camera(context)
+		if camera is None:
+			return NOT_CONNECTED
+		valid = validSettings(deref(pSettings))
+		deref(pValid).value = valid
+		packetInfo = deref(pPacketInfo)
+		if valid:
+			packetInfo.recommendedBytesPerPacket = MAX_PACKET_SIZE
+			packetInfo.maxBytesPerPacket = MAX_PACKET_SIZE
+			packetInfo.unitBytesPerPacket = PACKET_UNIT
+		return OK
+
+	def fc2SetTriggerMode(self, context, pTriggerMode):
+		camera = self.camera(context)
+		if camera is None:
+			return NOT_CONNECTED
+		pointer(camera.triggerMode)[0] = deref(pTriggerMode)
+		return OK
+
+	def fc2FireSoftwareTrigger(self, context):
+		camera = self.camera(context)
+		if camera is None:
+			return NOT_CONNECTED
+		if camera.triggerMode.onOff and camera.triggerMode.source == 7:
+			camera.trigger()
+		return OK
+
+# ----- Capture Functions
+
+	def fc2StartCapture(self, context):
+		camera = self.camera(context)
+		if camera is None:
+			return NOT_CONNECTED
+		if camera.capturing:
+			return ISOCH_ALREADY_STARTED
+		with camera.lock:
+			camera.capturing = True
+			camera.frames = []
+			camera.nextFreeRun = timer() + camera.period()
+		return OK
+
+	def fc2StopCapture(self, context):
+		camera = self.camera(context)
+		if camera is None:
+			return NOT_CONNECTED
+		if not camera.capturing:
+			return ISOCH_NOT_STARTED
+		with camera.lock:
+			camera.capturing = False
+			camera.frames = []
+		return OK
+
+	def fc2RetrieveBuffer(self, context, pImage):
+		camera = self.camera(context)
+		if camera is None:
+			return NOT_CONNECTED
+		if not camera.capturing:
+			return ISOCH_NOT_STARTED
+		deadline = timer() + camera.config.grabTimeout / 1000.
+		while True:
+			with camera.lock:
+				now = timer()
+				camera.freeRun(now)
+				ready = None
+				if camera.frames:
+					ready = camera.frames[0]
+					if ready <= now:
+						del camera.frames[0]
+						break
+			if now >= deadline:
+				return TIMEOUT
+			if ready is None:
+				time.sleep(min(0.001, deadline - now))
+			else:
+				time.sleep(max(min(ready, deadline) - now, 0))
+		s = camera.settings
+		data = camera.baseFrame()
+		im = deref(pImage)
+		buf = self.allocate(im, len(data))
+		memmove(buf, data, len(data))
+		if camera.registers.get(0x12F8, 0) & 0x1:
+			memmove(buf, pack('>I', encodeTimestamp(ready - camera.epoch)), 4)
+		im.rows = s.height
+		im.cols = s.width
+		im.stride = s.width * bytesPerPixel(s.pixelFormat)
+		im.receivedDataSize = len(data)
+		im.format = s.pixelFormat
+		im.bayerFormat = fc2BayerTileFormat['NONE']
+		return OK
+
+# ----- Image Functions
+
+	def allocate(self, im, size):
+		'''
+		Makes sure an fc2Image has a data buffer of the given size. pData is
+		always pointed at the buffer, as a new image may have been created at
+		the address of one which was never destroyed.
+		'''
+		addr = addressof(im)
+		buf = self.buffers.get(addr)
+		if buf is None or sizeof(buf) != size:
+			buf = create_string_buffer(size)
+			self.buffers[addr] = buf
+		im.pData = cast(buf, POINTER(c_ubyte))
+		im.dataSize = size
+		return buf
+
+	def fc2CreateImage(self, pImage):
+		im = deref(pImage)
+		self.buffers.pop(addressof(im), None)
+		im.rows = im.cols = im.stride = 0
+		im.pData = None
+		im.dataSize = im.receivedDataSize = 0
+		im.format = fc2PixelFormat['UNSPECIFIED_PIXEL_FORMAT']
+		return OK
+
+	def fc2DestroyImage(self, pImage):
+		im = deref(pImage)
+		self.buffers.pop(addressof(im), None)
+		im.pData = None
+		im.dataSize = 0
+		return OK
+
+	def pixels(self, im):
+		'''Returns a copy of the pixel data of an image as a numpy array.'''
+		bpp = bytesPerPixel(im.format)
+		data = string_at(im.pData, im.rows * im.stride)
+		if bpp in (2, 6):
+			dtype = numpy.uint16
+		else:
+			dtype = numpy.uint8
+		pixels = numpy.frombuffer(data, dtype).reshape(im.rows, -1)
+		channels = bpp // numpy.dtype(dtype).itemsize
+		pixels = pixels[:, :im.cols * channels]
+		if channels > 1:
+			pixels = pixels.reshape(im.rows, im.cols, channels)
+		return pixels
+
+	def fc2ConvertImageTo(self, pixelFormat, pSrc, pDst):
+		src = deref(pSrc)
+		dst = deref(pDst)
+		if not src.pData:
+			return INVALID_PARAMETER
+		mono = self.pixels(src)
+		if mono.ndim != 2:
+			return CONVERSION_FAILED
+		if mono.dtype == numpy.uint16:
+			mono8 = (mono >> 8).astype(numpy.uint8)
+			mono16 = mono
+		else:
+			mono8 = mono
+			mono16 = mono.astype(numpy.uint16) << 8
+		if pixelFormat == fc2PixelFormat['BGR']:
+			out = numpy.repeat(mono8[:, :, numpy.newaxis], 3, 2)
+		elif pixelFormat in (fc2PixelFormat['MONO8'], fc2PixelFormat['RAW8']):
+			out = mono8
+		elif pixelFormat in (fc2PixelFormat['MONO16'], fc2PixelFormat['RAW16']):
+			out = mono16
+		else:
+			return NOT_SUPPORTED
+		data = numpy.ascontiguousarray(out).tostring()
+		buf = self.allocate(dst, len(data))
+		memmove(buf, data, len(data))
+		dst.rows = src.rows
+		dst.cols = src.cols
+		dst.stride = src.cols * bytesPerPixel(pixelFormat)
+		dst.receivedDataSize = len(data)
+		dst.format = pixelFormat
+		dst.bayerFormat = fc2BayerTileFormat['NONE']
+		return OK
+
+	def fc2SaveImage(self, pImage, fname, fileFormat):
+		im = deref(pImage)
+		if not im.pData:
+			return INVALID_PARAMETER
+		fname = value(fname)
+		if fileFormat == fc2ImageFileFormat['RAW']:
+			data = string_at(im.pData, im.rows * im.stride)
+		elif fileFormat == fc2ImageFileFormat['PNG']:
+			data = self.encodePNG(self.pixels(im), im.format)
+		else:
+			return NOT_SUPPORTED
+		outfile = open(fname, 'wb')
+		outfile.write(data)
+		outfile.close()
+		return OK
+
+	def encodePNG(self, pixels, pixelFormat):
+		'''Encodes an image as a png file.'''
+		def chunk(kind, data):
+			return pack('>I', len(data)) + kind + data + pack('>I', zlib.crc32(kind + data) & 0xFFFFFFFF)
+		if pixelFormat == fc2PixelFormat['BGR']:
+			pixels = pixels[:, :, ::-1]
+			colorType = 2
+		else:
+			colorType = 0
+		depth = pixels.dtype.itemsize * 8
+		rows = pixels.astype(pixels.dtype.newbyteorder('>')).reshape(pixels.shape[0], -1)
+		rows = numpy.hstack((numpy.zeros((rows.shape[0], 1), numpy.uint8), rows.view(numpy.uint8)))
+		header = pack('>IIBBBBB', pixels.shape[1], pixels.shape[0], depth, colorType, 0, 0, 0)
+		return '\x89PNG\r\n\x1a\n' + chunk('IHDR', header) + chunk('IDAT', zlib.compress(rows.tostring(), 6)) + chunk('IEND', '')
@@ -287,6 +287,32 @@ class fc2Format7ImageSettings(Structure):
 				('reserved', c_uint*8)	
 	]
 	
+class fc2Format7Info(Structure):
+	_fields_ = [
+				('mode', c_int),
+				('maxWidth', c_uint),
+				('maxHeight', c_uint),
+				('offsetHStepSize', c_uint),
+				('offsetVStepSize', c_uint),
+				('imageHStepSize', c_uint),
+				('imageVStepSize', c_uint),
+				('pixelFormatBitField', c_uint),
+				('vendorPixelFormatBitField', c_uint),
+				('packetSize', c_uint),
+				('minPacketSize', c_uint),
+				('maxPacketSize', c_uint),
+				('percentage', c_float),
+				('reserved', c_uint*16)
+	]
+
+class fc2Format7PacketInfo(Structure):
+	_fields_ = [
+				('recommendedBytesPerPacket', c_uint),
+				('maxBytesPerPacket', c_uint),
+				('unitBytesPerPacket', c_uint),
+				('reserved', c_uint*8)
+	]
+
 class fc2Config(Structure):
 	_fields_ = [
 				('numBuffers', c_uint),
@@ -325,7 +351,7 @@ class fc2Image(Structure):
 				('rows', c_uint),
    				('cols', c_uint),
 				('stride', c_uint),
-				('pData', c_char_p),
+				('pData', POINTER(c_ubyte)),
 				('dataSize', c_uint),
 				('receivedDataSize', c_uint),
 				('format', c_uint),	#FC2PixelFormat
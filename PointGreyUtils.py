@@ -0,0 +1,121 @@
+'''
+Pure Python helpers shared by the PointGreyController modules: float and
+register word conversion, the region of interest and embedded timestamps.
+They do not need the FlyCapture2 library or NumPy, so processes which only
+handle settings or timestamps can import them cheaply.
+'''
+
+from struct import pack, unpack
+from math import ceil
+
+# ----- Conversion Functions ----- #
+
+def hexifier(fl):
+	'''
+	Converts a floating point number into a number corresponding to its
+	hexadecimal/binary representation. Used to convert settings values for input
+	into the camera registers.
+	'''
+	# Taken from:
+	# http://stackoverflow.com/questions/1922771/python-obtain-manipulate-as-integers-bit-patterns-of-floats
+	s = pack('>f', fl)
+	''.join('%2.2x' % ord(c) for c in s)
+	i = unpack('>l', s)[0]
+	return i
+	
+def floatifier(h):
+	'''
+	Converts a hexademical value returned by the camera registers to a floating
+	point number.
+	'''
+	neg = h & 0x80000000
+	h = h & 0x7fffffff
+	s = pack('>l', h)
+	''.join('%2.2x' % ord(c) for c in s)
+	i = unpack('>f', s)[0]
+	if neg:
+		i = -i
+	return i
+	
+# ----- Region of Interest ----- #
+
+class ROIError(Exception):
+	"""For errors in setting the Region of Interest"""
+	def __init__(self, value, issueStr):
+		self.msg = issueStr + str(value)
+		
+	def __str__(self):
+		return repr(self.msg)
+
+class ROI(object):
+	"""Defines the region of interest of the camera."""
+	
+	def __init__(self):
+		self.posLeft = 0
+		self.posTop = 0
+		self.width = 1288
+		self.height = 964
+	
+	def __str__(self):
+		return 'Left: %d, Top: %d, Width: %d, Height: %d' % (self.posLeft, self.posTop, self.width, self.height)
+	
+	def checkValues(self):
+		"""Verifies validity of ROI Values for Flea2 Camera."""
+		posTop = self.posTop	#Pixels from left to start ROI.
+		posLeft = self.posLeft	#Pixels from top to start ROI.
+		width = self.width		#Width (in pixels) of the ROI.
+		height = self.height	#Height (in pixels) of the ROI.
+		if not(0 <= posTop < 964):
+			raise ROIError(posTop, 'Top must be between 0 and 964. Currently ') 
+		if not(0 <= posLeft < 1288):
+			raise ROIError(posLeft, 'Left must be between 0 and 1288. Currently ')
+		if not(0 <= width <= 1288):
+			raise ROIError(width, 'Width must be between 0 and 1288. Currently ') 
+		if not(0 <= height <= 964):
+			raise ROIError(posTop, 'Height must be between 0 and 964. Currently ') 
+		if not(0 < posTop + height <= 964):
+			raise ROIError(posTop + height, 'Top + height must be <= 964. Currently ')
+		if not(0< posLeft + width <= 1288):
+			raise 0 < ROIError(posLeft + width, 'Left + width must be <=1288. Currently ')
+	
+	def setROI(self, posLeft, posTop, width, height):
+		"""Sets the ROI parameters explicitly."""
+		self.posLeft = posLeft - posLeft % 2	#Pixels from left to start ROI.
+		self.posTop = posTop - posTop % 2  #Pixels from top to start ROI.
+		self.width = int(ceil(width / 8.) * 8) 	#Width (in pixels) of the ROI.
+		self.height = height + height % 2		#Height (in pixels) of the ROI.
+		self.checkValues()
+	
+	def setROICenter(self, center, width, height):
+		"""
+		Sets the ROI parameters based on where the image center should be along
+		with the width and height. center is a tuple of the form (x, y).
+		"""
+		x = center[0]
+		y = center[1]
+		self.width = int(ceil(width / 8.) * 8) 	#Width (in pixels) of the ROI.
+		self.height = height + height % 2		#Height (in pixels) of the ROI.
+		hWidth = self.width/2
+		hHeight = self.height/2
+		l = x - hWidth
+		t = y - hHeight
+		self.posLeft = l - l % 2
+		self.posTop = t - t % 2
+		self.checkValues()	
+
+# ----- Timestamp ----- #
+
+class Timestamp(object):
+	"""Used to store and decode image timestamps."""
+
+	secondsPerCount = 1./8000.
+	countsPerOffset = 1./3072.
+	
+	def __init__(self, s, c, o):
+		self.seconds = s
+		self.count = c
+		self.offset = o
+	
+	def decodeTime(self):
+		"""Converts timestamp to time in seconds based on FlyCapture Documentation."""
+		return self.seconds + (self.count+self.offset*self.countsPerOffset)*self.secondsPerCount
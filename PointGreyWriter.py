@@ -0,0 +1,110 @@
+'''
+Bulk writer storing every frame of a run, the decoded timestamps and the
+controller settings in a single file, instead of one image file per frame
+and a separate log.
+
+Two formats are supported, chosen by file extension:
+- .h5 / .hdf5: HDF5 file (requires h5py) with a chunked, optionally gzip
+  compressed frames dataset of one chunk per frame. The settings are stored
+  as attributes of the file.
+- .npz: numpy archive holding the frames, timestamps and settings (as a JSON
+  string). Written compressed if compression is set.
+'''
+
+from PointGreyController import imageView
+import json
+import os
+import time
+import numpy
+
+try:
+	import h5py
+except ImportError:
+	h5py = None
+
+HDF5_EXTENSIONS = ('.h5', '.hdf5')
+
+def runMetadata(PGC):
+	'''Returns the settings of a controller's run as a dict.'''
+	roi = PGC.roi
+	return dict(
+		date = time.strftime('%y%m%d_%H%M%S'),
+		cameraIndex = PGC.cameraIndex,
+		numOfImages = len(PGC.rawImageData),
+		expTime_ms = PGC.expTime_ms,
+		gain = PGC.gain,
+		boostFramerate = bool(PGC.boostFramerate),
+		conversion = PGC.conversion,
+		roiLeft = roi.posLeft,
+		roiTop = roi.posTop,
+		roiWidth = roi.width,
+		roiHeight = roi.height,
+		)
+
+def saveRun(PGC, fpath, compression = False):
+	'''
+	Saves all images of the controller's last run (converted images if a
+	conversion policy is set) with their timestamps and the controller
+	settings into fpath.
+	'''
+	frames = [imageView(im) for im in PGC.conImageData]
+	timestamps = numpy.asarray(PGC.timestamps)
+	words = getattr(PGC, 'timestampWords', numpy.zeros(0, numpy.uint32))
+	metadata = runMetadata(PGC)
+	if os.path.splitext(fpath)[1].lower() in HDF5_EXTENSIONS:
+		writeHDF5(fpath, frames, timestamps, words, metadata, compression)
+	else:
+		writeNPZ(fpath, frames, timestamps, words, metadata, compression)
+
+def writeHDF5(fpath, frames, timestamps, words, metadata, compression = False):
+	'''Writes a run to an HDF5 file, one chunk per frame.'''
+	if h5py is None:
+		raise ImportError('h5py is required to write HDF5 files.')
+	outfile = h5py.File(fpath, 'w')
+	try:
+		if frames:
+			shape = frames[0].shape
+			dataset = outfile.create_dataset('frames', (len(frames),) + shape, frames[0].dtype,
+				chunks = (1,) + shape, compression = compression and 'gzip' or None)
+			for i in range(len(frames)):
+				dataset[i] = frames[i]
+		outfile.create_dataset('timestamps', data = timestamps)
+		outfile.create_dataset('timestampWords', data = words)
+		for (k, v) in metadata.items():
+			outfile.attrs[k] = v
+	finally:
+		outfile.close()
+
+def writeNPZ(fpath, frames, timestamps, words, metadata, compression = False):
+	'''Writes a run to a numpy archive.'''
+	if frames:
+		stack = numpy.empty((len(frames),) + frames[0].shape, frames[0].dtype)
+		for i in range(len(frames)):
+			stack[i] = frames[i]
+	else:
+		stack = numpy.zeros(0)
+	if compression:
+		save = numpy.savez_compressed
+	else:
+		save = numpy.savez
+	save(fpath, frames = stack, timestamps = timestamps, timestampWords = words, metadata = json.dumps(metadata))
+
+def loadRun(fpath):
+	'''
+	Loads a run saved by saveRun. Returns the frames, timestamps (ms since
+	the first frame) and settings. Frames of HDF5 files are returned as an
+	h5py dataset, so they are only read from disk as they are accessed; the
+	file stays open for as long as the dataset is in use.
+	'''
+	if os.path.splitext(fpath)[1].lower() in HDF5_EXTENSIONS:
+		if h5py is None:
+			raise ImportError('h5py is required to read HDF5 files.')
+		infile = h5py.File(fpath, 'r')
+		metadata = dict(infile.attrs.items())
+		frames = infile.get('frames', numpy.zeros(0))
+		return frames, infile['timestamps'][...], metadata
+	infile = numpy.load(fpath)
+	try:
+		return infile['frames'], infile['timestamps'], json.loads(str(infile['metadata']))
+	finally:
+		infile.close()
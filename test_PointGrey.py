@@ -0,0 +1,577 @@
+'''
+Regression tests, run against the simulated driver from PointGreySimDriver:
+
+	python -m unittest test_PointGrey
+'''
+
+from PointGreyController import *
+from PointGreySimDriver import SimulatedDriver, encodeTimestamp
+from PointGreyMultiController import PointGreyMultiController
+from PointGreyWriter import h5py, loadRun
+from PointGreyRecorder import RingRecorder, openRecording, readFrame, recordingTimestamps
+from PointGreyReduction import ReductionStage, roiSum
+from PointGreyControllerBuilder import PointGreyBuilder, PointGreyProfiles
+from PointGreyAnalysis import AbsorptionStage
+from threading import Thread, Event, Timer, active_count
+import PointGreyRunLog
+import PointGreyController as controllerModule
+import os
+import struct
+import time
+import shutil
+import tempfile
+import unittest
+import numpy
+
+try:
+	import trollius as asyncio
+	from trollius import From
+	from PointGreyAsync import AsyncPointGreyController
+except ImportError:
+	asyncio = None
+
+def wordsAt(times):
+	'''Embedded timestamp words of frames read out at the given times (s).'''
+	return numpy.array([encodeTimestamp(t) for t in times], numpy.uint32)
+
+class SimulatedTestCase(unittest.TestCase):
+	"""Runs each test against a fresh simulated camera."""
+
+	def setUp(self):
+		self.driver = SimulatedDriver(frameRate = 200.)
+		setDriver(self.driver)
+		self.controllers = []
+		self.tmpdir = tempfile.mkdtemp(prefix = 'pgc_test_')
+
+	def tearDown(self):
+		for PGC in self.controllers:
+			PGC.close()
+		shutil.rmtree(self.tmpdir)
+
+	def controller(self, numOfImages = 4, **kwargs):
+		kwargs.setdefault('persistent', True)
+		PGC = PointGreyController(numOfImages, 0.5, 0, **kwargs)
+		self.controllers.append(PGC)
+		PGC.enableSoftwareTrigger()
+		PGC.setDataBuffers(numOfImages)
+		return PGC
+
+	def runBatch(self, PGC, numOfImages):
+		PGC.start()
+		for i in range(numOfImages):
+			PGC.fireSoftwareTrigger()
+		PGC.stop()
+
+	def countCalls(self, name):
+		'''Records the arguments of every call of the named driver function.'''
+		calls = []
+		func = getattr(self.driver, name)
+		def counted(*args):
+			calls.append(args)
+			return func(*args)
+		setattr(self.driver, name, counted)
+		return calls
+
+class StreamingTest(SimulatedTestCase):
+
+	def testStreamedRun(self):
+		numOfImages = 8
+		PGC = self.controller(numOfImages)
+		PGC.startStreaming(numOfImages)
+		received = []
+		consumer = Thread(target = lambda: received.extend(i for (i, im) in PGC.streamImages()))
+		consumer.start()
+		for i in range(numOfImages):
+			PGC.fireSoftwareTrigger()
+		PGC.stop()
+		consumer.join(5)
+		self.assertFalse(consumer.isAlive())
+		self.assertEqual(received, range(numOfImages))
+		self.assertEqual(len(PGC.timestamps), numOfImages)
+		self.assertTrue(numpy.all(numpy.diff(PGC.timestamps) > 0))
+
+	def testLostTrigger(self):
+		PGC = self.controller(4)
+		PGC.streamTimeout = 0.2
+		PGC.startStreaming(4)
+		for i in range(3):
+			PGC.fireSoftwareTrigger()
+		PGC.stop()
+		self.assertEqual(len(PGC.rawImageData), 3)
+		self.assertEqual(len(PGC.timestamps), 3)
+
+	def testBatchRunAfterStreamedRun(self):
+		PGC = self.controller(4)
+		PGC.startStreaming(4)
+		for i in range(4):
+			PGC.fireSoftwareTrigger()
+		PGC.stop()
+		self.runBatch(PGC, 4)
+		self.assertEqual(len(PGC.timestamps), 4)
+
+class TimestampTest(unittest.TestCase):
+
+	def testFields(self):
+		(seconds, count, offset, times) = decodeTimestamps(wordsAt([5.25]))
+		self.assertEqual(seconds[0], 5)
+		self.assertEqual(count[0], 2000)
+		self.assertAlmostEqual(times[0], 5.25, 6)
+
+	def testWrap(self):
+		expected = numpy.array([126.9, 127.5, 128.1, 129.0, 255.5, 256.2])
+		times = decodeTimestamps(wordsAt(expected))[3]
+		numpy.testing.assert_allclose(times, expected, atol = 1e-6)
+
+	def testOutOfOrderIsNotAWrap(self):
+		expected = numpy.array([10., 10.01, 10.005, 10.02])
+		times = decodeTimestamps(wordsAt(expected))[3]
+		numpy.testing.assert_allclose(times, expected, atol = 1e-6)
+
+	def testSingleFrame(self):
+		self.assertEqual(len(decodeTimestamps(wordsAt([1.]))[3]), 1)
+
+class RegisterCacheTest(SimulatedTestCase):
+
+	def testUnchangedWritesAreSkipped(self):
+		PGC = self.controller()
+		writes = self.countCalls('fc2WriteRegister')
+		PGC.setExposureTime(1.)
+		self.assertEqual(len(writes), 1)
+		PGC.setExposureTime(1.)
+		self.assertEqual(len(writes), 1)
+		PGC.setRegister(writes[0][1], writes[0][2].value, force = True)
+		self.assertEqual(len(writes), 2)
+
+	def testQueuedWritesAreCoalesced(self):
+		PGC = self.controller()
+		writes = self.countCalls('fc2WriteRegister')
+		PGC.queueRegisterWrites()
+		PGC.setGain(1.)
+		PGC.setGain(2.)
+		self.assertEqual(writes, [])
+		PGC.flushRegisterWrites()
+		self.assertEqual(len(writes), 1)
+		PGC.invalidateRegisters()
+		self.assertAlmostEqual(PGC.getGain(), 2., 5)
+
+class MultiControllerTest(SimulatedTestCase):
+
+	def setUp(self):
+		SimulatedTestCase.setUp(self)
+		self.driver = SimulatedDriver(numOfCameras = 2, frameRate = 200.)
+		setDriver(self.driver)
+
+	def testSaveIntoDirectory(self):
+		multi = PointGreyMultiController(2, 0.5, 0, cameraIndices = [0, 1])
+		self.controllers.append(multi)
+		multi.enableSoftwareTrigger()
+		multi.setDataBuffers(2)
+		multi.start()
+		for i in range(2):
+			multi.fireSoftwareTrigger()
+		multi.stop()
+		multi.saveRAWImages(os.path.join(self.tmpdir, 'raw_%03d.raw'))
+		multi.saveLog(os.path.join(self.tmpdir, 'log.pgl'))
+		self.assertEqual(sorted(os.listdir(self.tmpdir)), ['cam0_log.pgl', 'cam0_log.pgl.idx',
+			'cam0_raw_000.raw', 'cam0_raw_001.raw', 'cam1_log.pgl', 'cam1_log.pgl.idx',
+			'cam1_raw_000.raw', 'cam1_raw_001.raw'])
+
+class SaveTest(SimulatedTestCase):
+
+	def setUp(self):
+		SimulatedTestCase.setUp(self)
+		self.saveWorkers = controllerModule.saveWorkers
+		self.release = Event()
+
+	def tearDown(self):
+		self.release.set()
+		SimulatedTestCase.tearDown(self)
+		setSaveWorkers(self.saveWorkers)
+
+	def holdSaves(self):
+		'''Keeps saves queued until self.release is set.'''
+		setSaveWorkers(1)
+		getSavePool().apply_async(self.release.wait)
+
+	def savedWords(self, fNameFormat, numOfImages):
+		'''Embedded timestamp words at the start of saved raw images.'''
+		words = []
+		for i in range(numOfImages):
+			infile = open(fNameFormat % i, 'rb')
+			words.append(struct.unpack('>I', infile.read(4))[0])
+			infile.close()
+		return words
+
+	def testShotsWithNewControllers(self):
+		threads = active_count()
+		for shot in range(5):
+			PGC = self.controller(2, persistent = False)
+			self.runBatch(PGC, 2)
+			PGC.saveRAWImages(os.path.join(self.tmpdir, 'shot%d_%%03d.raw' % shot), wait = False)
+			PGC.close()
+		self.assertEqual(len(os.listdir(self.tmpdir)), 10)
+		# Only the shared save pool may have been started.
+		self.assertTrue(active_count() <= threads + controllerModule.saveWorkers + 3)
+
+	def testBatchRunOverlapsSaves(self):
+		fNameFormat = os.path.join(self.tmpdir, 'raw_%03d.raw')
+		PGC = self.controller(2)
+		self.runBatch(PGC, 2)
+		words = list(PGC.frameWords)
+		self.holdSaves()
+		PGC.saveRAWImages(fNameFormat, wait = False)
+		# Saves are released late if start() waits for them.
+		Timer(2., self.release.set).start()
+		PGC.start()
+		self.assertTrue(PGC.savesPending())
+		for i in range(2):
+			PGC.fireSoftwareTrigger()
+		self.release.set()
+		PGC.stop()
+		self.assertEqual(self.savedWords(fNameFormat, 2), words)
+		self.assertNotEqual(list(PGC.frameWords), words)
+
+	def testStreamedRunSwapsBuffers(self):
+		fNameFormat = os.path.join(self.tmpdir, 'raw_%03d.raw')
+		PGC = self.controller(2)
+		self.runBatch(PGC, 2)
+		words = list(PGC.frameWords)
+		self.holdSaves()
+		PGC.saveRAWImages(fNameFormat, wait = False)
+		PGC.startStreaming(2)
+		for i in range(2):
+			PGC.fireSoftwareTrigger()
+		PGC.stop()
+		self.assertEqual(PGC.bufferSet, 1)
+		self.assertTrue(PGC.savesPending())
+		self.release.set()
+		PGC.waitForSaves()
+		self.assertEqual(self.savedWords(fNameFormat, 2), words)
+		self.assertEqual(len(PGC.timestamps), 2)
+
+	def testSetSaveWorkers(self):
+		self.assertRaises(ValueError, setSaveWorkers, 0)
+		setSaveWorkers(2)
+		self.assertEqual(getSavePool()._processes, 2)
+
+class BufferPoolTest(SimulatedTestCase):
+
+	def testResize(self):
+		pool = ImageBufferPool()
+		pool.setKey((64, 64))
+		images = list(pool.acquire('raw', 4))
+		destroyed = self.countCalls('fc2DestroyImage')
+		fewer = pool.acquire('raw', 2)
+		self.assertEqual(len(destroyed), 2)
+		self.assertTrue(fewer[0] is images[0] and fewer[1] is images[1])
+		more = pool.acquire('raw', 3)
+		self.assertEqual(len(more), 3)
+		self.assertTrue(more[1] is images[1])
+		pool.setKey((32, 32))
+		self.assertEqual(pool.sets, {})
+		self.assertEqual(len(destroyed), 5)
+
+	def testFreeBuffers(self):
+		PGC = self.controller(4)
+		self.runBatch(PGC, 4)
+		images = list(PGC.rawImageData)
+		self.runBatch(PGC, 4)
+		self.assertEqual(PGC.rawImageData, images)
+		destroyed = self.countCalls('fc2DestroyImage')
+		PGC.freeBuffers()
+		self.assertEqual(PGC.bufferPool.sets, {})
+		self.assertEqual(PGC.rawImageData, [])
+		self.assertTrue(len(destroyed) >= 4)
+
+class WriterTest(SimulatedTestCase):
+
+	def roundTrip(self, fname):
+		PGC = self.controller(4)
+		self.runBatch(PGC, 4)
+		fpath = os.path.join(self.tmpdir, fname)
+		PGC.saveRun(fpath)
+		(frames, timestamps, metadata) = loadRun(fpath)
+		self.assertEqual(len(frames), 4)
+		for i in range(4):
+			numpy.testing.assert_array_equal(frames[i], PGC.getImageView(i))
+		numpy.testing.assert_array_equal(timestamps, PGC.timestamps)
+		self.assertEqual(metadata['numOfImages'], 4)
+		self.assertEqual(metadata['roiWidth'], PGC.roi.width)
+
+	def testNPZ(self):
+		self.roundTrip('run.npz')
+
+	@unittest.skipIf(h5py is None, 'h5py is not installed')
+	def testHDF5(self):
+		self.roundTrip('run.h5')
+
+class RecorderTest(SimulatedTestCase):
+
+	def testFixedRecording(self):
+		PGC = self.controller(1)
+		fpath = os.path.join(self.tmpdir, 'rec.npy')
+		recorder = RingRecorder(PGC, fpath, 4)
+		recorder.start()
+		for i in range(4):
+			PGC.fireSoftwareTrigger()
+		recorder.wait(5)
+		self.assertTrue(recorder.isFull())
+		recorder.stop()
+		(frames, index, slots) = openRecording(fpath)
+		self.assertEqual(list(slots), range(4))
+		for slot in slots:
+			(number, word, frame) = readFrame(frames, index, slot)
+			self.assertEqual(number, slot)
+			numpy.testing.assert_array_equal(frame, frames[slot])
+		(numbers, times) = recordingTimestamps(fpath)
+		self.assertEqual(list(numbers), range(4))
+		self.assertTrue(numpy.all(numpy.diff(times) > 0))
+
+	def testCircularRecording(self):
+		PGC = self.controller(1)
+		fpath = os.path.join(self.tmpdir, 'rec.npy')
+		recorder = RingRecorder(PGC, fpath, 4, circular = True)
+		recorder.start()
+		for i in range(6):
+			PGC.fireSoftwareTrigger()
+		deadline = time.time() + 5
+		while recorder.framesWritten < 6 and time.time() < deadline:
+			time.sleep(0.01)
+		recorder.stop()
+		(frames, index, slots) = openRecording(fpath)
+		self.assertEqual([readFrame(frames, index, slot)[0] for slot in slots], range(2, 6))
+
+@unittest.skipIf(asyncio is None, 'trollius is not installed')
+class AsyncTest(SimulatedTestCase):
+
+	def testFrames(self):
+		PGC = self.controller(3)
+		camera = AsyncPointGreyController(PGC, asyncio.new_event_loop())
+		received = []
+		@asyncio.coroutine
+		def run():
+			yield From(camera.start(3))
+			for i in range(3):
+				yield From(camera.trigger())
+			for future in camera.frames():
+				frame = yield From(future)
+				if frame is None:
+					break
+				received.append(frame[0])
+			yield From(camera.stop())
+			yield From(camera.start(3))
+			self.assertRaises(RuntimeError, list, camera.frames())
+			for i in range(3):
+				yield From(camera.trigger())
+			yield From(camera.stop())
+		try:
+			camera.loop.run_until_complete(run())
+		finally:
+			camera.close()
+			camera.loop.close()
+		self.assertEqual(received, range(3))
+
+class FailingStage(object):
+	"""Processing stage whose end() fails."""
+
+	def begin(self, PGC, numOfImages):
+		pass
+
+	def process(self, index, frame):
+		pass
+
+	def end(self):
+		raise RuntimeError('Stage failed.')
+
+class StageTest(SimulatedTestCase):
+
+	def testReduction(self):
+		PGC = self.controller(4)
+		stage = ReductionStage(dict(sum = roiSum(0, 0, 8, 8)))
+		PGC.attachStage(stage)
+		self.runBatch(PGC, 4)
+		expected = [PGC.getImageView(i)[:8, :8].sum() for i in range(4)]
+		numpy.testing.assert_array_equal(stage.results['sum'], expected)
+
+	def testFailingStageDisconnects(self):
+		PGC = self.controller(2, persistent = False)
+		PGC.attachStage(FailingStage())
+		PGC.start()
+		for i in range(2):
+			PGC.fireSoftwareTrigger()
+		self.assertRaises(RuntimeError, PGC.stop)
+		self.assertFalse(PGC.connected)
+		self.assertFalse('ring' in PGC.bufferPool.sets)
+
+class FrameCheckTest(unittest.TestCase):
+
+	def testRegular(self):
+		report = checkFrames(wordsAt(1 + 0.01 * numpy.arange(20)), 10.)
+		self.assertTrue(report.ok())
+		self.assertEqual(report.dropped, 0)
+		self.assertAlmostEqual(report.sustainedRate_Hz, 100., 3)
+
+	def testDrop(self):
+		times = list(1 + 0.01 * numpy.arange(10))
+		del times[4:6]
+		report = checkFrames(wordsAt(times), 10.)
+		self.assertEqual(report.dropped, 2)
+		self.assertEqual(list(report.framesWith(FRAME_AFTER_DROP)), [4])
+
+	def testDuplicateAndOutOfOrder(self):
+		report = checkFrames(wordsAt([1., 1.01, 1.01, 1.03, 1.02]), 10.)
+		self.assertEqual(list(report.framesWith(FRAME_DUPLICATE)), [2])
+		self.assertEqual(list(report.framesWith(FRAME_OUT_OF_ORDER)), [4])
+
+	def testIrregular(self):
+		report = checkFrames(wordsAt([1., 1.01, 1.025, 1.035]), 10.)
+		self.assertEqual(list(report.framesWith(FRAME_IRREGULAR)), [2])
+
+	def testWithoutPeriod(self):
+		# Irregular software triggers are not an error without a period.
+		report = checkFrames(wordsAt([1., 1.01, 1.05, 1.051]))
+		self.assertTrue(report.ok())
+
+	def testStreamedRun(self):
+		setDriver(SimulatedDriver(frameRate = 200.))
+		PGC = PointGreyController(4, 0.5, 0, persistent = True)
+		try:
+			PGC.enableSoftwareTrigger()
+			PGC.setDataBuffers(4)
+			PGC.startStreaming(4)
+			for i in range(4):
+				PGC.fireSoftwareTrigger()
+			PGC.stop()
+			self.assertTrue(PGC.frameReport.ok())
+		finally:
+			PGC.close()
+
+class ReconfigureTest(SimulatedTestCase):
+
+	def testResizesBuffers(self):
+		PGC = self.controller(4)
+		self.runBatch(PGC, 4)
+		roi = ROI()
+		roi.setROICenter((644, 482), 320, 240)
+		PGC.reconfigure(roi = roi)
+		self.assertEqual(len(PGC.rawImageData), 4)
+		self.runBatch(PGC, 4)
+		self.assertEqual(PGC.getImageView(0).shape[:2], (240, 320))
+
+	def testUnchangedSettingsAreNotWritten(self):
+		PGC = self.controller(4)
+		writes = self.countCalls('fc2WriteRegister')
+		formats = self.countCalls('fc2SetFormat7Configuration')
+		PGC.reconfigure(expTime_ms = PGC.requestedSettings[0], gain = PGC.requestedSettings[1])
+		self.assertEqual(writes, [])
+		self.assertEqual(formats, [])
+
+class TriggerScheduleTest(SimulatedTestCase):
+
+	def testScheduledPeriodIsPerRun(self):
+		PGC = self.controller(4)
+		PGC.start()
+		PGC.scheduleTriggers(period = 0.1, count = 4)
+		PGC.stop()
+		self.assertEqual(PGC.runPeriod(), 100.)
+		self.assertTrue(PGC.frameReport.ok())
+		self.runBatch(PGC, 4)
+		self.assertEqual(PGC.runPeriod(), None)
+		self.assertTrue(PGC.frameReport.ok())
+
+class ProfileTest(SimulatedTestCase):
+
+	def testBuilderIgnoresUnknownKeys(self):
+		PGC = PointGreyBuilder(dict(expTime_ms = 0.5, numOfImages = 4)).buildController()
+		self.controllers.append(PGC)
+		self.assertRaises(ValueError, PointGreyProfiles(dict(a = dict(numOfImages = 4))).validate)
+
+	def testApplyUnchangedProfile(self):
+		profiles = PointGreyProfiles(dict(a = dict(expTime_ms = 1.3, gain = 2.7)))
+		PGC = self.controller()
+		profiles.apply(PGC, 'a')
+		calls = []
+		PGC.reconfigure = lambda *args: calls.append(args)
+		profiles.apply(PGC, 'a')
+		self.assertEqual(calls, [])
+
+	def testLimits(self):
+		self.assertRaises(ValueError, PointGreyProfiles(dict(a = dict(gain = 999, expTime_ms = 5000))).validate)
+		# Within the absolute range, but above the limit of the simulated camera.
+		profiles = PointGreyProfiles(dict(a = dict(expTime_ms = 66.5)))
+		profiles.validate()
+		self.assertRaises(propertyError, profiles.validate, self.controller())
+
+class AbsorptionRun(object):
+	"""Stands in for a controller streaming frames to an AbsorptionStage."""
+
+	def __init__(self, shape):
+		self.roi = ROI()
+		self.roi.setROI(0, 0, shape[1], shape[0])
+		self.frameWords = []
+
+	def runPeriod(self):
+		return None
+
+	def run(self, stage, frames, times):
+		'''Feeds frames read out at the given times (s) through the stage.'''
+		self.frameWords = wordsAt(times)
+		stage.begin(self, len(frames))
+		for (i, frame) in enumerate(frames):
+			stage.process(i, frame)
+		stage.end()
+
+class AbsorptionTest(unittest.TestCase):
+
+	def setUp(self):
+		self.shape = (8, 16)
+		self.atoms = numpy.ones(self.shape)
+		self.probe = numpy.ones(self.shape) * 2
+		self.dark = numpy.zeros(self.shape)
+		self.camera = AbsorptionRun(self.shape)
+
+	def testStatisticsKeptAcrossRuns(self):
+		stage = AbsorptionStage(period_ms = 10.)
+		for run in range(4):
+			self.camera.run(stage, [self.atoms, self.probe, self.dark], 1 + 0.01 * numpy.arange(3))
+		self.assertEqual(stage.sequences, 4)
+		self.assertEqual(stage.stats['od'].count, 4)
+		numpy.testing.assert_allclose(stage.stats['od'].mean, numpy.log(2), rtol = 1e-6)
+		stage.reset()
+		self.assertEqual(stage.stats['od'].count, 0)
+
+	def testDroppedFrameResynchronises(self):
+		stage = AbsorptionStage(period_ms = 10.)
+		# The probe frame of the first sequence is lost.
+		frames = [self.atoms, self.dark, self.atoms, self.probe, self.dark, self.atoms, self.probe, self.dark]
+		times = 1 + 0.01 * numpy.array([0, 2, 3, 4, 5, 6, 7, 8])
+		self.camera.run(stage, frames, times)
+		self.assertEqual(stage.dropped, 1)
+		self.assertEqual(stage.sequences, 2)
+		numpy.testing.assert_allclose(stage.stats['od'].mean, numpy.log(2), rtol = 1e-6)
+
+class RunLogTest(SimulatedTestCase):
+
+	def testRoundTrip(self):
+		fpath = os.path.join(self.tmpdir, 'log.pgl')
+		PGC = self.controller(4)
+		written = []
+		for run in range(3):
+			self.runBatch(PGC, 4)
+			self.assertEqual(PGC.saveLog(fpath), run)
+			written.append(PointGreyRunLog.runRecords(PGC))
+		(settings, records) = PointGreyRunLog.readRun(fpath, 1)
+		self.assertEqual(settings['run'], 1)
+		self.assertEqual(settings['numOfImages'], 4)
+		numpy.testing.assert_array_equal(records, written[1])
+		runs = PointGreyRunLog.readLog(fpath)
+		self.assertEqual(len(runs), 3)
+		for ((settings, records), expected) in zip(runs, written):
+			numpy.testing.assert_array_equal(records, expected)
+		index = PointGreyRunLog.readIndex(fpath)
+		os.remove(PointGreyRunLog.indexPath(fpath))
+		PointGreyRunLog.rebuildIndex(fpath)
+		numpy.testing.assert_array_equal(PointGreyRunLog.readIndex(fpath), index)
+
+if __name__ == '__main__':
+	unittest.main()